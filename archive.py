@@ -0,0 +1,85 @@
+import os
+import json
+import sqlite3
+
+# Output backends. 'files' is the original layout (one text file per post and
+# per response next to the media). 'jsonl' and 'sqlite' keep every plurk and
+# response of a user, as full API JSON, in a single append-only archive; media
+# entries reference the downloaded files by sha256 (the object's name in the
+# media store, see media_store.MediaStore).
+STORAGE_BACKENDS = ('files', 'jsonl', 'sqlite')
+DEFAULT_STORAGE = 'files'
+# Backends that keep one archive file open for a user's whole crawl
+ARCHIVE_STORAGES = ('jsonl', 'sqlite')
+
+
+def open_archive(storage, user_dir):
+    if storage == 'jsonl':
+        return JsonlArchive(os.path.join(user_dir, 'archive.jsonl'))
+    if storage == 'sqlite':
+        return SqliteArchive(os.path.join(user_dir, 'archive.sqlite3'))
+    return None
+
+
+class JsonlArchive:
+    # One JSON object per line; a plurk or response archived again on a later
+    # run is appended again, and the last record for an id wins.
+    def __init__(self, path):
+        self.path = path
+        self._file = open(path, 'ab')
+
+    def _append(self, record):
+        self._file.write(json.dumps(record, ensure_ascii=False).encode('utf-8') + b'\n')
+
+    def save_plurk(self, plurk, media):
+        self._append({'type': 'plurk', 'plurk_id': plurk['plurk_id'], 'plurk': plurk, 'media': media})
+
+    def save_response(self, plurk_id, response, media):
+        self._append({'type': 'response', 'plurk_id': plurk_id, 'response': response, 'media': media})
+
+    def commit(self):
+        self._file.flush()
+
+    def close(self):
+        self._file.close()
+
+
+class SqliteArchive:
+    SCHEMA = """
+    CREATE TABLE IF NOT EXISTS plurks (
+        plurk_id INTEGER PRIMARY KEY,
+        posted TEXT,
+        plurk TEXT NOT NULL,
+        media TEXT NOT NULL
+    );
+    CREATE TABLE IF NOT EXISTS responses (
+        plurk_id INTEGER NOT NULL,
+        response_id INTEGER NOT NULL,
+        posted TEXT,
+        response TEXT NOT NULL,
+        media TEXT NOT NULL,
+        PRIMARY KEY (plurk_id, response_id)
+    );
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._db = sqlite3.connect(path)
+        self._db.executescript(self.SCHEMA)
+
+    def save_plurk(self, plurk, media):
+        self._db.execute('INSERT OR REPLACE INTO plurks (plurk_id, posted, plurk, media) VALUES (?, ?, ?, ?)',
+                         (plurk['plurk_id'], plurk.get('posted'), json.dumps(plurk, ensure_ascii=False),
+                          json.dumps(media, ensure_ascii=False)))
+
+    def save_response(self, plurk_id, response, media):
+        self._db.execute('INSERT OR REPLACE INTO responses (plurk_id, response_id, posted, response, media) VALUES (?, ?, ?, ?, ?)',
+                         (plurk_id, response['id'], response.get('posted'), json.dumps(response, ensure_ascii=False),
+                          json.dumps(media, ensure_ascii=False)))
+
+    def commit(self):
+        self._db.commit()
+
+    def close(self):
+        self._db.commit()
+        self._db.close()
@@ -0,0 +1,56 @@
+import time
+import asyncio
+import collections
+from plurk_crawler import process_user, UserProgress
+
+# Users crawled at the same time in one batch; the others wait for a free
+# place. All of them share one HTTP session, API client and scheduler, and
+# the scheduler's page slots are handed out round-robin between them.
+PARALLEL_USERS = 8
+
+
+def read_user_file(path):
+    # One or more usernames per line; '#' starts a comment
+    user_names = []
+    with open(path, encoding='utf-8') as user_file:
+        for line in user_file:
+            user_names.extend(line.split('#', 1)[0].split())
+    return user_names
+
+
+async def run_batch(plurk, session, user_names, parallel_users=PARALLEL_USERS, **options):
+    # options are passed on to process_user (state, scheduler, store, ...)
+    report = [UserProgress(user_name) for user_name in dict.fromkeys(user_names)]
+    pending = collections.deque(report)
+    finished = 0
+
+    async def worker():
+        nonlocal finished
+        while pending:
+            progress = pending.popleft()
+            try:
+                await process_user(plurk, session, progress.user_name, progress=progress, **options)
+            except Exception as e:
+                print(f"An error occurred while backing up {progress.user_name}: {e}")
+                progress.status = 'failed'
+                progress.finished = time.time()
+                if options.get('scheduler') is not None:
+                    options['scheduler'].events.emit('user_finished', user=progress.user_name, status='failed',
+                                                     pages=progress.pages, plurks=progress.plurks,
+                                                     seconds=progress.finished - (progress.started or progress.finished))
+            finished += 1
+            print(f'[{finished}/{len(report)}] {progress.user_name}: {progress.status}')
+
+    await asyncio.gather(*[worker() for _ in range(max(1, min(parallel_users, len(report))))])
+    print_report(report)
+    return report
+
+
+def print_report(report):
+    completed = sum(progress.status == 'completed' for progress in report)
+    print(f"============================\nBatch report: {completed}/{len(report)} users completed")
+    width = max([len('user')] + [len(progress.user_name) for progress in report])
+    print(f"{'user':<{width}}  {'status':<12}{'pages':>7}{'plurks':>8}{'seconds':>9}")
+    for progress in report:
+        elapsed = (progress.finished or time.time()) - progress.started if progress.started else 0
+        print(f"{progress.user_name:<{width}}  {progress.status:<12}{progress.pages:>7}{progress.plurks:>8}{elapsed:>9.1f}")
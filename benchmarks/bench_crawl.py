@@ -0,0 +1,185 @@
+"""End-to-end crawler benchmark against a local fake Plurk API.
+
+Starts benchmarks/fake_plurk.py in a child process and runs
+plurk_crawler.process_user for one user through AsyncPlurkAPI(base_url=...),
+the real scheduler, state database and storage backend, in a temporary
+directory. Reports posts/s, MB/s, peak RSS and API calls per post.
+
+    python benchmarks/bench_crawl.py --posts 2000 --media-per-post 2 --api-latency 0.05
+    python benchmarks/bench_crawl.py --error-rate 0.02 --bandwidth-kbps 2048 --json
+    python benchmarks/bench_crawl.py --videos 3 --video-mb 64 --bandwidth-kbps 8192 --download-segments 1
+    python benchmarks/bench_crawl.py --posts 30 --media-per-post 0 --response-ratio 0 --videos 12 --video-mb 17 \
+        --bandwidth-kbps 20000
+
+The last one has more large videos in flight than downloads per host, so
+every connection of the pool is needed by segments at once.
+"""
+import os
+import sys
+import json
+import time
+import asyncio
+import argparse
+import tempfile
+import contextlib
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fake_plurk import FakePlurkConfig, run_in_process
+from plurk_api import AsyncPlurkAPI
+from plurk_crawler import process_user, PAGE_SIZE, PREFETCH_PAGES
+from crawl_state import CrawlState
+from media_store import MediaStore
+from url_status import UrlStatus
+from scheduler import Scheduler, API_CONCURRENCY, DOWNLOADS_PER_HOST, MAX_OPEN_FILES, LOW_MEMORY_OPEN_FILES
+from archive import STORAGE_BACKENDS, DEFAULT_STORAGE
+from workers import Workers, WORKER_MODES, DEFAULT_WORKER_MODE
+from events import Events
+from memory import MemoryLimit, LOW_MEMORY_LIMIT_MB
+from utils import create_session, DOWNLOAD_CHUNK_SIZE, DOWNLOAD_WRITE_BATCH, DOWNLOAD_SEGMENTS
+
+
+def peak_rss_mb():
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return peak / 2 ** 20 if sys.platform == 'darwin' else peak / 1024
+
+
+def seed_media(count):
+    # Media files saved by an earlier backup, as found in a big user's folder
+    if count:
+        os.mkdir('bench')
+    for k in range(count):
+        open(os.path.join('bench', f"2000_1_01-plurk-x{k}-1-1.jpg"), 'wb').close()
+
+
+async def crawl(args, base_url, events):
+    state = CrawlState('state.db')
+    store = None if args.no_media_store else MediaStore('media_store', state)
+    scheduler = Scheduler(args.api_concurrency, args.downloads_per_host,
+                          LOW_MEMORY_OPEN_FILES if args.low_memory else MAX_OPEN_FILES, args.api_rate,
+                          Workers(args.workers), events=events,
+                          write_batch=DOWNLOAD_CHUNK_SIZE if args.low_memory else DOWNLOAD_WRITE_BATCH,
+                          download_segments=args.download_segments, url_status=UrlStatus(state),
+                          memory_limit=MemoryLimit(args.memory_limit_mb) if args.low_memory else None)
+    try:
+        async with create_session(limit_per_host=scheduler.connections_per_host) as session:
+            plurk = AsyncPlurkAPI(session, 'key', 'secret', 'token', 'token-secret', base_url=base_url)
+            completed = await process_user(plurk, session, 'bench', state, full=True, scheduler=scheduler,
+                                           page_size=args.page_size, prefetch_pages=args.prefetch_pages,
+                                           storage=args.storage, store=store, low_memory=args.low_memory)
+            async with session.get(f"{base_url}/stats") as response:
+                stats = await response.json()
+    finally:
+        scheduler.close()
+        state.close()
+    return completed, stats
+
+
+def main(args):
+    config = FakePlurkConfig(args.posts, args.media_per_post, args.media_kb, args.response_ratio,
+                             args.responses_per_post, args.api_latency, args.media_latency,
+                             args.bandwidth_kbps, args.error_rate, args.seed, args.videos, args.video_mb,
+                             not args.no_ranges)
+    server = run_in_process(config, args.port)
+    cwd = os.getcwd()
+    events = Events()
+    downloads = []
+    events.subscribe(lambda record: downloads.append(record['seconds']) if record['event'] == 'download' else None)
+    try:
+        with tempfile.TemporaryDirectory() as out_dir:
+            os.chdir(out_dir)
+            seed_media(args.existing_media)
+            started = time.perf_counter()
+            with open(os.devnull, 'w', encoding='utf-8') as devnull, \
+                    contextlib.redirect_stdout(sys.stdout if args.verbose else devnull):
+                completed, stats = asyncio.run(
+                    asyncio.wait_for(crawl(args, f"http://127.0.0.1:{args.port}", events), args.timeout))
+            elapsed = time.perf_counter() - started
+            # Read before the output is deleted: removing a directory of many
+            # thousands of files costs more memory than the crawl itself
+            peak = peak_rss_mb()
+            # Leave the directory before it is removed (required on Windows)
+            os.chdir(cwd)
+    finally:
+        os.chdir(cwd)
+        server.terminate()
+
+    megabytes = stats['media_bytes'] / 2 ** 20
+    result = {
+        'completed': completed,
+        'posts': args.posts,
+        'seconds': round(elapsed, 3),
+        'posts_per_s': round(args.posts / elapsed, 1),
+        'mb': round(megabytes, 1),
+        'mb_per_s': round(megabytes / elapsed, 2),
+        'peak_rss_mb': round(peak, 1) if peak is not None else None,
+        'api_calls': stats['api_calls'],
+        'api_calls_per_post': round(stats['api_calls'] / args.posts, 3),
+        'media_requests': stats['media_requests'],
+        'range_requests': stats['range_requests'],
+        'slowest_download_s': round(max(downloads, default=0), 3),
+        'injected_errors': stats['errors'],
+    }
+    if args.json:
+        print(json.dumps(result))
+        return result
+    print(f"{args.posts} posts x {args.media_per_post} media x {args.media_kb} KB, "
+          f"api latency {args.api_latency * 1000:.0f} ms, media latency {args.media_latency * 1000:.0f} ms, "
+          f"bandwidth {args.bandwidth_kbps or 'unlimited'} KB/s, error rate {args.error_rate:.1%}")
+    print(f"completed      {completed}")
+    print(f"time           {elapsed:.2f} s")
+    print(f"posts/s        {result['posts_per_s']}")
+    print(f"MB/s           {result['mb_per_s']} ({result['mb']} MB)")
+    print(f"peak RSS       {result['peak_rss_mb']} MB")
+    print(f"API calls      {stats['api_calls']} ({result['api_calls_per_post']} per post)")
+    print(f"media requests {stats['media_requests']} ({stats['range_requests']} ranges), "
+          f"injected errors {stats['errors']}")
+    print(f"slowest media  {result['slowest_download_s']} s")
+    return result
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--posts', type=int, default=1000, help="timeline size")
+    parser.add_argument('--media-per-post', type=int, default=1)
+    parser.add_argument('--media-kb', type=int, default=128, help="size of each media file")
+    parser.add_argument('--response-ratio', type=float, default=0.3, help="share of posts with responses")
+    parser.add_argument('--responses-per-post', type=int, default=5)
+    parser.add_argument('--api-latency', type=float, default=0.02, help="seconds per API call")
+    parser.add_argument('--media-latency', type=float, default=0.02, help="seconds before a media response")
+    parser.add_argument('--bandwidth-kbps', type=int, default=0, help="per-connection media bandwidth, 0 for unlimited")
+    parser.add_argument('--error-rate', type=float, default=0.0, help="share of requests answered with 502/503")
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--videos', type=int, default=0, help="newest posts that also link a large .mp4")
+    parser.add_argument('--video-mb', type=int, default=64)
+    parser.add_argument('--no-ranges', action='store_true', help="fake media host ignores Range requests")
+    parser.add_argument('--existing-media', type=int, default=0,
+                        help="empty media files put in the user's folder before the crawl")
+    parser.add_argument('--download-segments', type=int, default=DOWNLOAD_SEGMENTS,
+                        help="parallel Range requests per large download, 1 for a single stream")
+    parser.add_argument('--port', type=int, default=8791)
+    parser.add_argument('--api-rate', type=float, default=1000.0,
+                        help="client API rate limit; high by default so the crawler itself is measured")
+    parser.add_argument('--api-concurrency', type=int, default=API_CONCURRENCY)
+    parser.add_argument('--downloads-per-host', type=int, default=DOWNLOADS_PER_HOST)
+    parser.add_argument('--page-size', type=int, default=PAGE_SIZE)
+    parser.add_argument('--prefetch-pages', type=int, default=PREFETCH_PAGES)
+    parser.add_argument('--storage', choices=STORAGE_BACKENDS, default=DEFAULT_STORAGE)
+    parser.add_argument('--no-media-store', action='store_true')
+    parser.add_argument('--workers', choices=WORKER_MODES, default=DEFAULT_WORKER_MODE)
+    parser.add_argument('--timeout', type=float, default=600, help="fail the benchmark after this many seconds")
+    parser.add_argument('--low-memory', action='store_true', help="crawl in the crawler's --low-memory mode")
+    parser.add_argument('--memory-limit-mb', type=float, default=LOW_MEMORY_LIMIT_MB,
+                        help="RSS ceiling enforced by --low-memory")
+    parser.add_argument('--verbose', action='store_true', help="show the crawler's log")
+    parser.add_argument('--json', action='store_true', help="print the results as one JSON object")
+    return parser.parse_args(argv)
+
+
+if __name__ == '__main__':
+    sys.exit(0 if main(parse_args())['completed'] else 1)
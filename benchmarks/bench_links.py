@@ -0,0 +1,95 @@
+"""Compare the legacy media-link parsers with utils.extract_media_links.
+
+Runs both over a corpus of plurk content HTML (the markup the API returns in
+'content': picture links with mx_ thumbnails, emoticons, plain links, links
+with query strings) and reports the time per item and the links each finds.
+
+    python benchmarks/bench_links.py --items 100000
+"""
+import os
+import re
+import sys
+import time
+import random
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils import extract_media_links, url_validation_pattern as url_validation_regex
+
+SAMPLES = [
+    '今天天氣很好',
+    '<a href="https://images.plurk.com/5oT3QpXuTWkMVJ1wDMcGnz.jpg" class="pictureservices" rel="nofollow">'
+    '<img src="https://images.plurk.com/mx_5oT3QpXuTWkMVJ1wDMcGnz.jpg" alt="https://images.plurk.com/5oT3QpXuTWkMVJ1wDMcGnz.jpg" height="40"/></a> 晚餐',
+    '<a href="https://images.plurk.com/2b9nTPb0iJyUWQ3wAWv7vB.png" class="pictureservices" rel="nofollow">'
+    '<img src="https://images.plurk.com/mx_2b9nTPb0iJyUWQ3wAWv7vB.png" height="40"/></a> '
+    '<a href="https://images.plurk.com/6Ys0C4rPT3Ef2cFMuZB4YI.gif" class="pictureservices" rel="nofollow">'
+    '<img src="https://images.plurk.com/mx_6Ys0C4rPT3Ef2cFMuZB4YI.gif" height="40"/></a>',
+    '好累 <img src="https://s.plurk.com/emoticons/platinum/8c5cd6f4ab41ea0c0cfc2ef5a34f24e7.gif" class="emoticon" alt="(tears)" height="19" />',
+    '<a href="https://www.plurk.com/p/oz1qm6" class="ex_link" rel="nofollow">plurk.com/p/oz1qm6</a>',
+    '<a href="https://pbs.twimg.com/media/FqW1aXsaUAE6k7B.jpeg" class="ex_link pictureservices" rel="nofollow">'
+    '<img src="https://images.plurk.com/mx_FqW1aXsaUAE6k7B.jpeg" height="40"/></a>',
+    '<a href="https://video.example.com/clip.webm?dl=1&amp;t=30" class="ex_link" rel="nofollow">clip</a> 看這個',
+    '<a href="https://images.plurk.com/4q3bRnSfFlWmEKhMOaHGUw.mp4" class="ex_link" rel="nofollow">video</a> '
+    '<img src="https://emos.plurk.com/a3f1d2c0b8e4_w48_h48.png" class="emoticon_my" height="48" />',
+    '<a href="https://www.youtube.com/watch?v=dQw4w9WgXcQ" class="ex_link meta" rel="nofollow">'
+    '<img src="https://i.ytimg.com/vi/dQw4w9WgXcQ/hqdefault.jpg" height="40"/> Never Gonna Give You Up</a>',
+    ' '.join(['長文'] * 200),
+]
+
+
+def legacy_post_links(content):
+    links = []
+    for content in content.split():
+        if content.startswith('href'):
+            content = content[:-1]
+            supported_format = ['jpg', 'png', 'gif', 'mp4', 'webp', 'bmp', 'svg']
+            if content[-3:] in supported_format:
+                if re.match(url_validation_regex, str(content[6:])) is None:
+                    continue
+                links.append((str(content[6:]), content[-3:]))
+    return links
+
+
+def legacy_response_links(content_str):
+    links = []
+    match = re.findall(r"href=\S+", content_str)
+    matchList = []
+    for matchCase in match:
+        matchCase = matchCase[:-1]
+        matchCase = matchCase[6:]
+        matchList.append(matchCase)
+    for responseLink in matchList:
+        supported_format = ['jpg', 'png', 'gif', 'mp4', 'webp', 'bmp', 'svg']
+        if responseLink[-3:] in supported_format:
+            if re.match(url_validation_regex, responseLink) is None:
+                continue
+            links.append((responseLink, responseLink[-3:]))
+    return links
+
+
+def bench(fn, corpus):
+    started = time.perf_counter()
+    found = 0
+    for content in corpus:
+        found += len(fn(content))
+    return time.perf_counter() - started, found
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--items', type=int, default=100000, help="posts/responses in the corpus")
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    corpus = random.Random(args.seed).choices(SAMPLES, k=args.items)
+    print(f"{args.items} items")
+    print(f"{'parser':<12}{'seconds':>10}{'us/item':>10}{'links':>10}")
+    for name, fn in (('post', legacy_post_links), ('response', legacy_response_links), ('extract', extract_media_links)):
+        elapsed, found = bench(fn, corpus)
+        print(f"{name:<12}{elapsed:>10.3f}{elapsed / args.items * 1e6:>10.2f}{found:>10}")
+    print()
+    for content in SAMPLES:
+        if extract_media_links(content) != legacy_response_links(content):
+            print(f"legacy:  {legacy_response_links(content)}")
+            print(f"extract: {extract_media_links(content)}")
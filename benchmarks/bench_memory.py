@@ -0,0 +1,71 @@
+"""Peak memory check for --low-memory on a very large timeline.
+
+Runs the same bench_crawl backup twice, each in its own process, in the
+default mode and in the crawler's low-memory mode: a synthetic timeline
+(1M posts by default) saved with the files layout into a user folder that
+already holds the media of an earlier backup, plus a few large videos
+downloaded in segments. Exits with status 1 when the low-memory crawl does
+not complete, when its peak RSS goes over the budget (also passed to it as
+--memory-limit-mb, so the mode has to stay under it to finish), or when it
+peaks no lower than the default mode. The fake server runs in its own
+process and is not counted.
+
+    python benchmarks/bench_memory.py
+    python benchmarks/bench_memory.py --posts 200000 --existing-media 200000 --budget-mb 96
+"""
+import os
+import sys
+import json
+import argparse
+import subprocess
+
+BENCH_CRAWL = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'bench_crawl.py')
+BUDGET_MB = 128
+
+
+def crawl(args, low_memory):
+    argv = [sys.executable, BENCH_CRAWL, '--posts', str(args.posts), '--media-per-post', '0',
+            '--response-ratio', str(args.response_ratio), '--existing-media', str(args.existing_media),
+            '--videos', str(args.videos), '--video-mb', str(args.video_mb), '--api-latency', '0',
+            '--media-latency', '0', '--storage', 'files', '--port', str(args.port),
+            '--timeout', str(args.timeout), '--json']
+    if low_memory:
+        argv += ['--low-memory', '--memory-limit-mb', str(args.budget_mb)]
+    finished = subprocess.run(argv, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True)
+    lines = finished.stdout.strip().splitlines()
+    return json.loads(lines[-1]) if lines else {'completed': False, 'peak_rss_mb': None, 'seconds': None}
+
+
+def main(args):
+    default = crawl(args, False)
+    low = crawl(args, True)
+    for mode, result in (('default', default), ('low-memory', low)):
+        print(f"{mode:<11} completed {result['completed']}, peak RSS {result['peak_rss_mb']} MB, "
+              f"{result['seconds']} s")
+    if low['peak_rss_mb'] is None or default['peak_rss_mb'] is None:
+        print("peak RSS is not available on this platform")
+        return low['completed']
+    within = low['peak_rss_mb'] <= args.budget_mb
+    lower = low['peak_rss_mb'] < default['peak_rss_mb']
+    print(f"low-memory peak {low['peak_rss_mb']} MB for {args.posts} posts, budget {args.budget_mb} MB: "
+          f"{'ok' if within else 'OVER BUDGET'}; "
+          f"{'lower than' if lower else 'NOT LOWER THAN'} the default mode's {default['peak_rss_mb']} MB")
+    return low['completed'] and within and lower
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--posts', type=int, default=1000000, help="timeline size")
+    parser.add_argument('--existing-media', type=int, default=1000000,
+                        help="media files already in the user's folder from an earlier backup")
+    parser.add_argument('--videos', type=int, default=24, help="newest posts that also link a large video")
+    parser.add_argument('--video-mb', type=int, default=20)
+    parser.add_argument('--budget-mb', type=float, default=BUDGET_MB, help="peak RSS allowed for the crawl")
+    parser.add_argument('--response-ratio', type=float, default=0.0)
+    parser.add_argument('--port', type=int, default=8792)
+    parser.add_argument('--timeout', type=float, default=3600, help="seconds allowed for each crawl")
+    return parser.parse_args(argv)
+
+
+if __name__ == '__main__':
+    sys.exit(0 if main(parse_args()) else 1)
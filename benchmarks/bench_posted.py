@@ -0,0 +1,64 @@
+"""Compare the legacy 'posted' handling with utils.parse_posted.
+
+For every post the crawler needs the file-name date, the next page offset and
+the epoch (checkpoint filter, crawl state). The legacy code rebuilt the month
+table and split the string for each of these; parse_posted splits once and
+caches the result.
+
+    python benchmarks/bench_posted.py --items 200000
+"""
+import os
+import sys
+import time
+import random
+import argparse
+import calendar
+import email.utils
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils import parse_posted
+
+
+def legacy(posted):
+    splitStr = posted.split()
+    abbr_to_num = {name: num for num, name in enumerate(calendar.month_abbr) if num}
+    fileNameTime = splitStr[3] + '_' + str(abbr_to_num[splitStr[2]]) + '_' + splitStr[1]
+    splitStr = posted.split()
+    abbr_to_num = {name: num for num, name in enumerate(calendar.month_abbr) if num}
+    nextOffset = f"{splitStr[3]}-{abbr_to_num[splitStr[2]]}-{splitStr[1]}T{splitStr[4]}"
+    epoch = calendar.timegm(email.utils.parsedate(posted))
+    return epoch, fileNameTime, nextOffset
+
+
+def current(posted):
+    # The same three uses, each going through the cached parse
+    return parse_posted(posted).epoch, parse_posted(posted).file_date, parse_posted(posted).offset
+
+
+def bench(fn, corpus):
+    started = time.perf_counter()
+    for posted in corpus:
+        fn(posted)
+    return time.perf_counter() - started
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--items', type=int, default=200000, help="posts/responses in the corpus")
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    now = int(time.time())
+    corpus = [time.strftime('%a, %d %b %Y %H:%M:%S GMT', time.gmtime(now - rng.randrange(10 * 365 * 86400)))
+              for _ in range(args.items)]
+    mismatches = sum(legacy(posted) != tuple(parse_posted(posted)) for posted in corpus[:1000])
+    parse_posted.cache_clear()
+
+    print(f"{args.items} items")
+    print(f"{'parser':<10}{'seconds':>10}{'us/item':>10}")
+    for name, fn in (('legacy', legacy), ('parsed', current)):
+        elapsed = bench(fn, corpus)
+        print(f"{name:<10}{elapsed:>10.3f}{elapsed / args.items * 1e6:>10.2f}")
+    print(f"mismatches in first 1000: {mismatches}")
@@ -0,0 +1,82 @@
+"""Compare the crawler worker modes on a synthetic timeline.
+
+Serves media from a local aiohttp server and runs the real per-post stages
+(text write, streaming download, a sha256 pass over each file standing in for
+the CPU-bound stages) under each mode in workers.WORKER_MODES.
+
+    python benchmarks/bench_workers.py --posts 300 --media 3 --size-kb 256
+"""
+import os
+import sys
+import time
+import asyncio
+import argparse
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from aiohttp import web
+from scheduler import Scheduler
+from workers import Workers, WORKER_MODES
+from utils import create_session, download_image, write_text, hash_file
+
+
+async def start_media_server(payload, latency, port):
+    async def media(request):
+        if latency:
+            await asyncio.sleep(latency)
+        return web.Response(body=payload, content_type='image/jpeg')
+
+    app = web.Application()
+    app.router.add_get('/media/{name}', media)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, '127.0.0.1', port).start()
+    return runner
+
+
+async def run_mode(mode, args, base_url, out_dir):
+    scheduler = Scheduler(workers=Workers(mode))
+
+    async def post_job(post_id):
+        text = f"post {post_id} " * 40
+        await scheduler.workers.io(write_text, os.path.join(out_dir, f"{post_id}-text.txt"), text)
+        names = [os.path.join(out_dir, f"{post_id}-{n}.jpg") for n in range(args.media)]
+        await asyncio.gather(*[download_image(session, f"{base_url}/media/{post_id}-{n}.jpg", name, scheduler)
+                               for n, name in enumerate(names)])
+        await asyncio.gather(*[scheduler.workers.cpu(hash_file, name) for name in names])
+
+    started = time.perf_counter()
+    async with create_session() as session:
+        for page in range(0, args.posts, 30):
+            await asyncio.gather(*[post_job(post_id) for post_id in range(page, min(page + 30, args.posts))])
+    elapsed = time.perf_counter() - started
+    scheduler.close()
+    return elapsed
+
+
+async def main(args):
+    payload = os.urandom(args.size_kb * 1024)
+    runner = await start_media_server(payload, args.latency, args.port)
+    base_url = f"http://127.0.0.1:{args.port}"
+    total_mb = args.posts * args.media * args.size_kb / 1024
+    print(f"{args.posts} posts x {args.media} media x {args.size_kb} KB, latency {args.latency * 1000:.0f} ms")
+    print(f"{'mode':<10}{'seconds':>10}{'posts/s':>10}{'MB/s':>10}")
+    try:
+        for mode in args.modes:
+            with tempfile.TemporaryDirectory() as out_dir:
+                elapsed = await run_mode(mode, args, base_url, out_dir)
+            print(f"{mode:<10}{elapsed:>10.2f}{args.posts / elapsed:>10.1f}{total_mb / elapsed:>10.1f}")
+    finally:
+        await runner.cleanup()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--posts', type=int, default=300)
+    parser.add_argument('--media', type=int, default=3, help="media files per post")
+    parser.add_argument('--size-kb', type=int, default=256, help="size of each media file")
+    parser.add_argument('--latency', type=float, default=0.02, help="media server latency in seconds")
+    parser.add_argument('--port', type=int, default=8790)
+    parser.add_argument('--modes', nargs='+', choices=WORKER_MODES, default=list(WORKER_MODES))
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,196 @@
+"""Local stand-in for the Plurk API and its media hosts, for benchmarks.
+
+Serves /APP/Profile/getPublicProfile, /APP/Timeline/getPublicPlurks,
+/APP/Timeline/getPlurk and /APP/Responses/get (with from_response paging) for any username, plus
+/media/<name> files (with byte ranges, and optionally a few large .mp4
+videos), with configurable latency, per-connection bandwidth, error rate and
+timeline size. run_in_process() starts it in a child process
+so it doesn't share the crawler's CPU or memory numbers.
+"""
+import time
+import random
+import asyncio
+import calendar
+import multiprocessing
+import email.utils
+from aiohttp import web
+
+USER_ID = 42
+# Newest post; older ones follow one hour apart
+NEWEST_POSTED = 1700000000
+RESPONSES_PAGE = 50
+MEDIA_CHUNK = 64 * 1024
+
+
+class FakePlurkConfig:
+    def __init__(self, posts=1000, media_per_post=1, media_kb=128, response_ratio=0.3, responses_per_post=5,
+                 api_latency=0.02, media_latency=0.02, bandwidth_kbps=0, error_rate=0.0, seed=1,
+                 videos=0, video_mb=64, ranges=True):
+        self.posts = posts
+        self.media_per_post = media_per_post
+        self.media_kb = media_kb
+        self.response_ratio = response_ratio
+        self.responses_per_post = responses_per_post
+        self.api_latency = api_latency
+        self.media_latency = media_latency
+        # Per connection, 0 for unlimited
+        self.bandwidth_kbps = bandwidth_kbps
+        # Share of API calls answered 502 and media requests answered 503
+        self.error_rate = error_rate
+        self.seed = seed
+        # The newest `videos` posts also link a video of video_mb
+        self.videos = videos
+        self.video_mb = video_mb
+        # Whether media requests honour Range (and say so with Accept-Ranges)
+        self.ranges = ranges
+
+
+def _posted(epoch):
+    return email.utils.formatdate(epoch, usegmt=True)
+
+
+def _media_links(base_url, plurk_id, count, tag):
+    links = []
+    for n in range(count):
+        url = f"{base_url}/media/{plurk_id}-{tag}{n}.jpg"
+        thumbnail = f"{base_url}/media/mx_{plurk_id}-{tag}{n}.jpg"
+        links.append(f'<a href="{url}" class="pictureservices" rel="nofollow"><img src="{thumbnail}" height="40"/></a>')
+    return ' '.join(links)
+
+
+def build_app(config, base_url):
+    rng = random.Random(config.seed)
+
+    def post(k):
+        # Built on demand from its index so a 1M post timeline costs no memory
+        post_rng = random.Random(config.seed * 1000003 + k)
+        plurk_id = 1000 + k
+        response_count = config.responses_per_post if post_rng.random() < config.response_ratio else 0
+        return {'plurk_id': plurk_id, 'owner_id': USER_ID, 'favorite_count': post_rng.randrange(5),
+                'response_count': response_count, 'posted': _posted(NEWEST_POSTED - k * 3600),
+                'content': f"post {k} " + _media_links(base_url, plurk_id, config.media_per_post, 'p')
+                + (f' <a href="{base_url}/media/{plurk_id}-v.mp4">video</a>' if k < config.videos else '')}
+
+    # Media bytes repeat `pattern`, starting with the file name so every file differs
+    pattern = bytes(rng.getrandbits(8) for _ in range(4096))
+    repeated = pattern * (MEDIA_CHUNK // len(pattern) + 2)
+    stats = {'api_calls': 0, 'media_requests': 0, 'range_requests': 0, 'media_bytes': 0, 'errors': 0}
+
+    def media_bytes(name, start, stop):
+        skip = start % len(pattern)
+        chunk = repeated[skip:skip + stop - start]
+        if start < len(name):
+            chunk = name[start:stop] + chunk[len(name[start:stop]):]
+        return chunk
+
+
+    def fail():
+        if config.error_rate and rng.random() < config.error_rate:
+            stats['errors'] += 1
+            return True
+        return False
+
+    async def api(request):
+        stats['api_calls'] += 1
+        form = await request.post()
+        if config.api_latency:
+            await asyncio.sleep(config.api_latency)
+        if fail():
+            return web.json_response({'error_text': 'injected error'}, status=502)
+        path = request.path
+        if path == '/APP/Profile/getPublicProfile':
+            return web.json_response({'user_info': {'id': USER_ID, 'nick_name': form.get('user_id'),
+                                                    'plurks_count': config.posts},
+                                      'plurks_count': config.posts})
+        if path == '/APP/Timeline/getPublicPlurks':
+            offset = calendar.timegm(time.strptime(form['offset'], '%Y-%m-%dT%H:%M:%S'))
+            limit = int(form.get('limit', 30))
+            # posts are newest first, one hour apart
+            first = max(0, -((offset - NEWEST_POSTED) // 3600))
+            while first < config.posts and NEWEST_POSTED - first * 3600 >= offset:
+                first += 1
+            return web.json_response({'plurks': [post(k) for k in range(first, min(config.posts, first + limit))]})
+        if path == '/APP/Timeline/getPlurk':
+            k = int(form['plurk_id']) - 1000
+            if not 0 <= k < config.posts:
+                return web.json_response({'error_text': 'Plurk not found'}, status=404)
+            return web.json_response({'plurk': post(k)})
+        if path == '/APP/Responses/get':
+            plurk_id = int(form['plurk_id'])
+            count = post(plurk_id - 1000)['response_count'] if 0 <= plurk_id - 1000 < config.posts else 0
+            start = int(form.get('from_response', 0))
+            responses = [{'id': n + 1, 'user_id': USER_ID if n % 2 == 0 else 7, 'posted': _posted(NEWEST_POSTED),
+                          'content': f"response {n} " + _media_links(base_url, plurk_id, 1 if n % 3 == 0 else 0, f'r{n}-')}
+                         for n in range(start, min(count, start + RESPONSES_PAGE))]
+            return web.json_response({'responses': responses, 'response_count': count})
+        return web.json_response({'error_text': 'unknown API'}, status=404)
+
+    async def media(request):
+        stats['media_requests'] += 1
+        if config.media_latency:
+            await asyncio.sleep(config.media_latency)
+        if fail():
+            return web.Response(status=503)
+        name = request.match_info['name'].encode()
+        video = name.endswith(b'.mp4')
+        size = config.video_mb * 2 ** 20 if video else config.media_kb * 1024
+        first, last = 0, size - 1
+        headers = {'Content-Type': 'video/mp4' if video else 'image/jpeg'}
+        status = 200
+        if config.ranges:
+            headers['Accept-Ranges'] = 'bytes'
+            requested = request.http_range
+            if request.headers.get('Range') and requested.start is not None:
+                stats['range_requests'] += 1
+                first = requested.start
+                last = min(size, requested.stop) - 1 if requested.stop is not None else size - 1
+                if first >= size:
+                    return web.Response(status=416, headers={'Content-Range': f'bytes */{size}'})
+                headers['Content-Range'] = f'bytes {first}-{last}/{size}'
+                status = 206
+        headers['Content-Length'] = str(last - first + 1)
+        response = web.StreamResponse(status=status, headers=headers)
+        await response.prepare(request)
+        try:
+            for start in range(first, last + 1, MEDIA_CHUNK):
+                chunk = media_bytes(name, start, min(start + MEDIA_CHUNK, last + 1))
+                await response.write(chunk)
+                stats['media_bytes'] += len(chunk)
+                if config.bandwidth_kbps:
+                    await asyncio.sleep(len(chunk) / (config.bandwidth_kbps * 1024))
+            await response.write_eof()
+        except ConnectionError:
+            # Segmented downloads close the first response once they have its head
+            pass
+        return response
+
+    async def get_stats(request):
+        return web.json_response(stats)
+
+    app = web.Application()
+    app.router.add_post('/APP/{group}/{name}', api)
+    app.router.add_get('/media/{name}', media)
+    app.router.add_get('/stats', get_stats)
+    return app
+
+
+def serve(config, port, ready):
+    async def main():
+        app = build_app(config, f"http://127.0.0.1:{port}")
+        runner = web.AppRunner(app, access_log=None)
+        await runner.setup()
+        await web.TCPSite(runner, '127.0.0.1', port).start()
+        ready.set()
+        await asyncio.Event().wait()
+
+    asyncio.run(main())
+
+
+def run_in_process(config, port):
+    ready = multiprocessing.Event()
+    process = multiprocessing.Process(target=serve, args=(config, port, ready), daemon=True)
+    process.start()
+    if not ready.wait(30):
+        process.terminate()
+        raise RuntimeError(f"fake Plurk server did not start on port {port}")
+    return process
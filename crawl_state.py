@@ -0,0 +1,164 @@
+import sqlite3
+import time
+
+# Local crawl state shared by every user backed up from this directory.
+# It records which plurks were archived (with their response_count at the
+# time) and the newest plurk seen by the last completed crawl, so a re-run
+# only walks the timeline down to that checkpoint.
+STATE_DB_PATH = './plurk_backup_state.db'
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS users (
+    user_id INTEGER PRIMARY KEY,
+    user_name TEXT NOT NULL,
+    newest_posted INTEGER,
+    last_completed_at INTEGER
+);
+CREATE TABLE IF NOT EXISTS posts (
+    user_id INTEGER NOT NULL,
+    plurk_id INTEGER NOT NULL,
+    posted INTEGER NOT NULL,
+    response_count INTEGER NOT NULL,
+    fetched_at INTEGER NOT NULL,
+    PRIMARY KEY (user_id, plurk_id)
+);
+CREATE TABLE IF NOT EXISTS failed_posts (
+    user_id INTEGER NOT NULL,
+    plurk_id INTEGER NOT NULL,
+    reason TEXT NOT NULL,
+    attempts INTEGER NOT NULL,
+    failed_at INTEGER NOT NULL,
+    PRIMARY KEY (user_id, plurk_id)
+);
+CREATE TABLE IF NOT EXISTS media_urls (
+    url TEXT PRIMARY KEY,
+    sha256 TEXT NOT NULL,
+    ext TEXT NOT NULL,
+    size INTEGER,
+    fetched_at INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS url_status (
+    url TEXT PRIMARY KEY,
+    status INTEGER NOT NULL,
+    etag TEXT,
+    last_modified TEXT,
+    size INTEGER,
+    checked_at INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS progress (
+    user_id INTEGER PRIMARY KEY,
+    time_offset TEXT NOT NULL,
+    lower_bound INTEGER,
+    newest_posted INTEGER,
+    updated_at INTEGER NOT NULL
+);
+"""
+
+
+class CrawlState:
+    def __init__(self, path=STATE_DB_PATH):
+        self.path = path
+        self._db = sqlite3.connect(path)
+        self._db.executescript(SCHEMA)
+        self._db.commit()
+
+    def close(self):
+        self._db.commit()
+        self._db.close()
+
+    def commit(self):
+        self._db.commit()
+
+    def newest_posted(self, user_id):
+        row = self._db.execute('SELECT newest_posted FROM users WHERE user_id = ?', (user_id,)).fetchone()
+        return row[0] if row else None
+
+    def finish_user(self, user_id, user_name, newest_posted):
+        # Only called once a crawl reached its lower bound, so the checkpoint
+        # never moves past posts that were not archived yet.
+        self._db.execute(
+            """INSERT INTO users (user_id, user_name, newest_posted, last_completed_at) VALUES (?, ?, ?, ?)
+               ON CONFLICT(user_id) DO UPDATE SET
+                   user_name = excluded.user_name,
+                   newest_posted = MAX(COALESCE(users.newest_posted, 0), COALESCE(excluded.newest_posted, 0)),
+                   last_completed_at = excluded.last_completed_at""",
+            (user_id, user_name, newest_posted, int(time.time())))
+        self._db.execute('DELETE FROM progress WHERE user_id = ?', (user_id,))
+        self._db.commit()
+
+    def progress(self, user_id):
+        # (time_offset, lower_bound, newest_posted) of an interrupted crawl
+        row = self._db.execute('SELECT time_offset, lower_bound, newest_posted FROM progress WHERE user_id = ?',
+                               (user_id,)).fetchone()
+        return tuple(row) if row else None
+
+    def save_progress(self, user_id, time_offset, lower_bound, newest_posted):
+        self._db.execute(
+            """INSERT INTO progress (user_id, time_offset, lower_bound, newest_posted, updated_at) VALUES (?, ?, ?, ?, ?)
+               ON CONFLICT(user_id) DO UPDATE SET
+                   time_offset = excluded.time_offset,
+                   lower_bound = excluded.lower_bound,
+                   newest_posted = excluded.newest_posted,
+                   updated_at = excluded.updated_at""",
+            (user_id, time_offset, lower_bound, newest_posted, int(time.time())))
+
+    def response_count(self, user_id, plurk_id):
+        row = self._db.execute('SELECT response_count FROM posts WHERE user_id = ? AND plurk_id = ?',
+                               (user_id, plurk_id)).fetchone()
+        return row[0] if row else None
+
+    def record_post(self, user_id, plurk_id, posted, response_count):
+        self._db.execute(
+            """INSERT INTO posts (user_id, plurk_id, posted, response_count, fetched_at) VALUES (?, ?, ?, ?, ?)
+               ON CONFLICT(user_id, plurk_id) DO UPDATE SET
+                   response_count = excluded.response_count,
+                   fetched_at = excluded.fetched_at""",
+            (user_id, plurk_id, posted, response_count, int(time.time())))
+        self._db.execute('DELETE FROM failed_posts WHERE user_id = ? AND plurk_id = ?', (user_id, plurk_id))
+
+    def failed_posts(self, user_id, max_attempts):
+        # Plurks that failed on earlier runs and have attempts left
+        rows = self._db.execute('SELECT plurk_id FROM failed_posts WHERE user_id = ? AND attempts < ? ORDER BY plurk_id',
+                                (user_id, max_attempts)).fetchall()
+        return [row[0] for row in rows]
+
+    def record_failed_post(self, user_id, plurk_id, reason):
+        self._db.execute(
+            """INSERT INTO failed_posts (user_id, plurk_id, reason, attempts, failed_at) VALUES (?, ?, ?, 1, ?)
+               ON CONFLICT(user_id, plurk_id) DO UPDATE SET
+                   reason = excluded.reason,
+                   attempts = failed_posts.attempts + 1,
+                   failed_at = excluded.failed_at""",
+            (user_id, plurk_id, reason, int(time.time())))
+
+    def media_for_url(self, url):
+        # (sha256, ext) of a media URL already in the media store
+        row = self._db.execute('SELECT sha256, ext FROM media_urls WHERE url = ?', (url,)).fetchone()
+        return tuple(row) if row else None
+
+    def record_media_url(self, url, sha256, ext, size):
+        self._db.execute(
+            """INSERT INTO media_urls (url, sha256, ext, size, fetched_at) VALUES (?, ?, ?, ?, ?)
+               ON CONFLICT(url) DO UPDATE SET
+                   sha256 = excluded.sha256,
+                   ext = excluded.ext,
+                   size = excluded.size,
+                   fetched_at = excluded.fetched_at""",
+            (url, sha256, ext, size, int(time.time())))
+
+    def url_status(self, url):
+        # (status, etag, last_modified, size, checked_at) of the last request for a media URL
+        row = self._db.execute('SELECT status, etag, last_modified, size, checked_at FROM url_status WHERE url = ?',
+                               (url,)).fetchone()
+        return tuple(row) if row else None
+
+    def record_url_status(self, url, status, etag=None, last_modified=None, size=None):
+        self._db.execute(
+            """INSERT INTO url_status (url, status, etag, last_modified, size, checked_at) VALUES (?, ?, ?, ?, ?, ?)
+               ON CONFLICT(url) DO UPDATE SET
+                   status = excluded.status,
+                   etag = excluded.etag,
+                   last_modified = excluded.last_modified,
+                   size = excluded.size,
+                   checked_at = excluded.checked_at""",
+            (url, status, etag, last_modified, size, int(time.time())))
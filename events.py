@@ -0,0 +1,56 @@
+import sys
+import json
+import time
+
+# Structured progress events. The crawler reports what it does through
+# Events.emit(name, **fields) and every listener (a plain callable) receives
+# a dict such as
+#   {"event": "page_done", "time": 1700000000.0, "user": "alice", ...}
+# Emitting with no listener is a no-op, so the hot paths only pay for it
+# when someone is listening. Events emitted by the crawler:
+#   user_started   user, user_id, plurks_count, expected_plurks (None unless
+#                  the whole timeline is walked)
+#   page_fetched   user, plurks, offset, queue_depth, seconds, put_wait
+#   post_done      user, plurk_id, ok, skipped, seconds
+#   page_done      user, pages, plurks, failed, queue_wait, slot_wait, seconds
+#   user_finished  user, status, pages, plurks, seconds
+#   api_call       path, status, attempt, wait (rate limiter), seconds
+#   api_retry      path, reason, attempt, delay
+#   download       url, ok, bytes, seconds
+#   disk_write     what (post, responses, commit), seconds
+EVENTS_TO_STDERR = '-'
+
+
+class Events:
+    def __init__(self):
+        self._listeners = []
+
+    @property
+    def enabled(self):
+        return bool(self._listeners)
+
+    def subscribe(self, listener):
+        self._listeners.append(listener)
+
+    def emit(self, event, **fields):
+        if not self._listeners:
+            return
+        record = {'event': event, 'time': time.time(), **fields}
+        for listener in self._listeners:
+            listener(record)
+
+
+class JsonLinesWriter:
+    # Listener writing one JSON object per line to a file, or to stderr for
+    # EVENTS_TO_STDERR, so the events stay apart from the printed log
+    def __init__(self, target):
+        self._owned = target != EVENTS_TO_STDERR
+        self._stream = open(target, 'a', encoding='utf-8') if self._owned else sys.stderr
+
+    def __call__(self, record):
+        self._stream.write(json.dumps(record, ensure_ascii=False, default=str) + '\n')
+        self._stream.flush()
+
+    def close(self):
+        if self._owned:
+            self._stream.close()
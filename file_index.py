@@ -0,0 +1,34 @@
+import os
+import re
+
+# Media files already saved in a user's folder, listed with one os.scandir
+# pass when the user's crawl starts so skip decisions don't cost an
+# os.path.isfile call per link (slow with hundreds of thousands of files, or
+# on a network drive). Files are matched by their full name: the plurk,
+# media number and extension alone don't identify a file, since link
+# numbering changed between versions. Downloads are added as they finish.
+MEDIA_FILE_PATTERN = re.compile(r'-plurk-[0-9a-z]+-\d+(?:-response-\d+)?-\d+\.\w+$')
+
+
+class FileIndex:
+    def __init__(self, folder):
+        self.folder = folder
+        self._names = set()
+        try:
+            with os.scandir(folder) as entries:
+                for entry in entries:
+                    if MEDIA_FILE_PATTERN.search(entry.name) and entry.is_file():
+                        self._names.add(entry.name)
+        except FileNotFoundError:
+            pass
+
+    def __len__(self):
+        return len(self._names)
+
+    def find(self, image_name):
+        # Path of the saved file for this media name, or None
+        name = os.path.basename(image_name)
+        return os.path.join(self.folder, name) if name in self._names else None
+
+    def add(self, image_name):
+        self._names.add(os.path.basename(image_name))
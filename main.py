@@ -2,9 +2,24 @@ import os
 import sys
 import time
 import asyncio
+import argparse
+import calendar
 from dotenv import load_dotenv
 from plurk_oauth import PlurkAPI
-from plurk_crawler import process_user
+from plurk_crawler import CrawlFilter, PAGE_SIZE, PREFETCH_PAGES
+from batch import run_batch, read_user_file, PARALLEL_USERS
+from plurk_api import AsyncPlurkAPI
+from archive import STORAGE_BACKENDS, DEFAULT_STORAGE, ARCHIVE_STORAGES
+from media_store import MediaStore, MEDIA_STORE_DIR
+from url_status import UrlStatus, DEAD_URL_TTL, OK_URL_TTL
+from crawl_state import CrawlState, STATE_DB_PATH
+from scheduler import Scheduler, API_CONCURRENCY, DOWNLOADS_PER_HOST, MAX_OPEN_FILES, PAGE_SLOTS, LOW_MEMORY_OPEN_FILES
+from ratelimit import API_RATE
+from workers import Workers, WORKER_MODES, DEFAULT_WORKER_MODE, WORKER_THREADS
+from utils import create_session, DOWNLOAD_CHUNK_SIZE, DOWNLOAD_WRITE_BATCH, DOWNLOAD_SEGMENTS, SEGMENTED_DOWNLOAD_MIN_SIZE
+from events import Events, JsonLinesWriter, EVENTS_TO_STDERR
+from profiling import StageProfile, LoopProfiler, PROFILERS
+from memory import MemoryLimit, LOW_MEMORY_LIMIT_MB
 
 # Load Environment Variables
 load_dotenv()
@@ -45,21 +60,169 @@ def prompt_for_missing_env():
                     f.write(f"ACCESS_TOKEN_SECRET={access_token_secret}\n")
             print("Saved to .env")
 
-prompt_for_missing_env()
+def parse_date(value):
+    # UTC date for --since/--until: YYYY-MM-DD or YYYY-MM-DDTHH:MM:SS
+    for date_format in ("%Y-%m-%d", "%Y-%m-%dT%H:%M:%S"):
+        try:
+            return calendar.timegm(time.strptime(value, date_format))
+        except ValueError:
+            pass
+    raise argparse.ArgumentTypeError(f"invalid date {value!r}, expected YYYY-MM-DD or YYYY-MM-DDTHH:MM:SS")
 
-async def main():
+def parse_args():
+    parser = argparse.ArgumentParser(description="Back up the plurks, responses and media of Plurk users.")
+    parser.add_argument('usernames', nargs='*', help="Plurk user accounts to back up")
+    parser.add_argument('--user-file',
+                        help="file with more usernames to back up, one or more per line ('#' starts a comment)")
+    parser.add_argument('--parallel-users', type=int, default=PARALLEL_USERS,
+                        help=f"users backed up at the same time; the rest wait their turn (default: {PARALLEL_USERS})")
+    parser.add_argument('--page-slots', type=int, default=PAGE_SLOTS,
+                        help="timeline pages processed at once across all users, handed out round-robin "
+                             f"(default: {PAGE_SLOTS})")
+    parser.add_argument('--full', action='store_true',
+                        help="ignore the incremental checkpoint and walk each timeline back to the first post; "
+                             "responses are only fetched again for posts whose response count changed")
+    parser.add_argument('--refetch', action='store_true',
+                        help="archive every post walked again, with its responses and media, even when unchanged")
+    parser.add_argument('--resume', action='store_true',
+                        help="continue interrupted crawls from their last checkpointed page")
+    parser.add_argument('--state-db', default=STATE_DB_PATH,
+                        help=f"crawl state database used for incremental backups (default: {STATE_DB_PATH})")
+    parser.add_argument('--api-concurrency', type=int, default=API_CONCURRENCY,
+                        help=f"maximum Plurk API calls in flight (default: {API_CONCURRENCY})")
+    parser.add_argument('--api-rate', type=float, default=API_RATE,
+                        help=f"maximum Plurk API calls per second; lowered automatically when throttled (default: {API_RATE})")
+    parser.add_argument('--downloads-per-host', type=int, default=DOWNLOADS_PER_HOST,
+                        help=f"maximum media downloads in flight per host (default: {DOWNLOADS_PER_HOST})")
+    parser.add_argument('--download-segments', type=int, default=DOWNLOAD_SEGMENTS,
+                        help=f"parallel range requests per media file over {SEGMENTED_DOWNLOAD_MIN_SIZE // 2 ** 20} MB, "
+                             f"1 to download everything as a single stream (default: {DOWNLOAD_SEGMENTS})")
+    parser.add_argument('--recheck-urls', action='store_true',
+                        help=f"retry media links found dead on earlier runs (otherwise skipped for "
+                             f"{DEAD_URL_TTL // 86400} days) and revalidate stored media now instead of after "
+                             f"{OK_URL_TTL // 86400} days")
+    parser.add_argument('--max-open-files', type=int, default=MAX_OPEN_FILES,
+                        help="maximum files held open at once by downloads (one per stream or segment), text writers "
+                             f"and per-user archives (default: {MAX_OPEN_FILES})")
+    parser.add_argument('--storage', choices=STORAGE_BACKENDS, default=DEFAULT_STORAGE,
+                        help="output format: one text file per post and response (files), or a single per-user "
+                             f"archive.jsonl / archive.sqlite3 holding the full API JSON (default: {DEFAULT_STORAGE})")
+    parser.add_argument('--media-store', default=MEDIA_STORE_DIR,
+                        help="content-addressed store where each distinct media file is kept once; per-post file "
+                             f"names are links into it (default: {MEDIA_STORE_DIR})")
+    parser.add_argument('--no-media-store', action='store_true',
+                        help="download media straight to the per-post file names without deduplication")
+    parser.add_argument('--page-size', type=int, default=PAGE_SIZE,
+                        help=f"plurks requested per timeline page, at most {PAGE_SIZE} (default: {PAGE_SIZE})")
+    parser.add_argument('--prefetch-pages', type=int, default=PREFETCH_PAGES,
+                        help=f"timeline pages fetched ahead of processing (default: {PREFETCH_PAGES})")
+    parser.add_argument('--since', type=parse_date,
+                        help="only back up plurks posted at or after this UTC date (YYYY-MM-DD[THH:MM:SS])")
+    parser.add_argument('--until', type=parse_date,
+                        help="only back up plurks posted before this UTC date; the timeline is read starting there")
+    parser.add_argument('--media-only', action='store_true',
+                        help="only back up plurks that contain media links")
+    parser.add_argument('--min-favorites', type=int, default=0,
+                        help="only back up plurks with at least this many favorites (default: 0)")
+    parser.add_argument('--owner-responses-only', action='store_true',
+                        help="only keep the responses written by the timeline owner")
+    parser.add_argument('--events', metavar='PATH',
+                        help="write structured progress events as JSON lines to PATH, or to stderr with "
+                             f"'{EVENTS_TO_STDERR}' (pages, posts, downloads, API calls, retries and their latency)")
+    parser.add_argument('--profile', action='store_true',
+                        help="time every stage (API calls, downloads, disk writes, queue waits) and print latency "
+                             "percentiles at the end")
+    parser.add_argument('--profile-output', metavar='PATH',
+                        help="also profile the event loop and write the stats to PATH (pstats format)")
+    parser.add_argument('--profiler', choices=PROFILERS, default=PROFILERS[0],
+                        help="profiler for --profile-output; yappi must be installed separately (default: cprofile)")
+    parser.add_argument('--low-memory', action='store_true',
+                        help="bound memory on very large timelines and media folders: saved media is checked on disk "
+                             f"instead of indexed, downloads are written chunk by chunk, at most {LOW_MEMORY_OPEN_FILES} "
+                             "files are open, and the crawl stops (resumable) if it goes over --memory-limit-mb")
+    parser.add_argument('--memory-limit-mb', type=float, default=LOW_MEMORY_LIMIT_MB,
+                        help=f"resident memory ceiling with --low-memory (default: {LOW_MEMORY_LIMIT_MB})")
+    parser.add_argument('--workers', choices=WORKER_MODES, default=DEFAULT_WORKER_MODE,
+                        help="where blocking disk writes and CPU stages run: inline on the event loop (asyncio), "
+                             f"in a thread pool (thread) or CPU stages in a process pool (process) (default: {DEFAULT_WORKER_MODE})")
+    parser.add_argument('--worker-threads', type=int, default=WORKER_THREADS,
+                        help=f"size of the worker thread pool (default: {WORKER_THREADS})")
+    return parser.parse_args()
+
+def authorize_access_token():
+    # Without a stored access token, run plurk_oauth's interactive
+    # verifier flow once; the crawl itself uses the async client.
+    global access_token, access_token_secret
+    if access_token and access_token_secret:
+        return
     plurk = PlurkAPI(consumer_key, consumer_secret)
-    plurk.authorize(access_token, access_token_secret)
+    plurk.authorize()
+    access_token = plurk._oauth.oauth_token['oauth_token']
+    access_token_secret = plurk._oauth.oauth_token['oauth_token_secret']
 
-    if len(sys.argv) == 1:
+async def main(args):
+    user_names_list = list(args.usernames)
+    if args.user_file:
+        user_names_list += read_user_file(args.user_file)
+    if not user_names_list:
         user_names_list = input("Please enter at least one username OR several usernames with space separated:")
         user_names_list = user_names_list.split()
-    else:
-        user_names_list = sys.argv[1:]
-    #async with aiomultiprocess.Pool() as pool:
-    await asyncio.gather(*[process_user(plurk, user_name) for user_name in user_names_list])
+    max_open_files = min(args.max_open_files, LOW_MEMORY_OPEN_FILES) if args.low_memory else args.max_open_files
+    parallel_users = args.parallel_users
+    if args.storage in ARCHIVE_STORAGES:
+        # Each user's archive holds an open file slot for its whole crawl;
+        # leave at least one slot for downloads and writes
+        if max_open_files < 2:
+            print(f"--storage {args.storage} needs --max-open-files of at least 2")
+            return False
+        if parallel_users >= max_open_files:
+            parallel_users = max_open_files - 1
+            print(f"Backing up {parallel_users} users at a time to stay within {max_open_files} open files")
+    state = CrawlState(args.state_db)
+    store = None if args.no_media_store else MediaStore(args.media_store, state)
+    crawl_filter = CrawlFilter(args.since, args.until, args.media_only, args.min_favorites, args.owner_responses_only)
+    workers = Workers(args.workers, args.worker_threads)
+    events = Events()
+    events_writer = JsonLinesWriter(args.events) if args.events else None
+    if events_writer is not None:
+        events.subscribe(events_writer)
+    stage_profile = StageProfile() if args.profile else None
+    if stage_profile is not None:
+        events.subscribe(stage_profile)
+    write_batch = DOWNLOAD_CHUNK_SIZE if args.low_memory else DOWNLOAD_WRITE_BATCH
+    scheduler = Scheduler(args.api_concurrency, args.downloads_per_host, max_open_files, args.api_rate, workers,
+                          args.page_slots, events, write_batch, args.download_segments,
+                          UrlStatus(state, args.recheck_urls),
+                          MemoryLimit(args.memory_limit_mb) if args.low_memory else None)
+    try:
+        async with create_session(limit_per_host=scheduler.connections_per_host) as session:
+            plurk = AsyncPlurkAPI(session, consumer_key, consumer_secret, access_token, access_token_secret)
+            report = await run_batch(plurk, session, user_names_list, parallel_users,
+                                     state=state, full=args.full, refetch=args.refetch, resume=args.resume, scheduler=scheduler,
+                                     page_size=args.page_size, prefetch_pages=args.prefetch_pages,
+                                     storage=args.storage, store=store, crawl_filter=crawl_filter,
+                                     low_memory=args.low_memory)
+    finally:
+        scheduler.close()
+        state.close()
+        if events_writer is not None:
+            events_writer.close()
+    if stage_profile is not None:
+        stage_profile.print_summary()
+    return all(progress.status == 'completed' for progress in report)
   
 if __name__ == "__main__":
+    args = parse_args()
+    prompt_for_missing_env()
+    authorize_access_token()
+    loop_profiler = LoopProfiler(args.profiler) if args.profile_output else None
+    if loop_profiler is not None:
+        loop_profiler.start()
     t1 = time.time()
-    asyncio.run(main())
+    try:
+        completed = asyncio.run(main(args))
+    finally:
+        if loop_profiler is not None:
+            loop_profiler.stop(args.profile_output)
     print("============================\nTotal time: {}\n".format(time.time() - t1))
+    sys.exit(0 if completed else 1)
@@ -0,0 +1,108 @@
+import os
+import shutil
+import asyncio
+import hashlib
+from utils import download_image, NOT_MODIFIED
+
+# Content-addressed media store shared by every user in this directory.
+# Each distinct file is kept once as <root>/<sha256[:2]>/<sha256>.<ext>; a
+# URL -> sha256 index (in the crawl state database when one is used) means a
+# URL seen before is never downloaded again, and the legacy per-post file
+# names are created as hardlinks (or symlinks/copies) to the stored object.
+MEDIA_STORE_DIR = './.media_store'
+
+
+def link_file(source, target):
+    try:
+        os.link(source, target)
+        return
+    except FileExistsError:
+        return
+    except OSError:
+        pass
+    try:
+        os.symlink(os.path.relpath(source, os.path.dirname(os.path.abspath(target))), target)
+    except OSError:
+        shutil.copyfile(source, target)
+
+
+class MediaStore:
+    def __init__(self, root=MEDIA_STORE_DIR, state=None):
+        self.root = root
+        self.state = state
+        # The state database is the URL index when there is one; the
+        # in-memory index would only grow with every URL of the crawl.
+        self._urls = {} if state is None else None
+        self._inflight = {}
+        os.makedirs(os.path.join(root, 'tmp'), exist_ok=True)
+
+    def object_path(self, sha256, ext):
+        return os.path.join(self.root, sha256[:2], f"{sha256}.{ext}")
+
+    def lookup(self, url):
+        # (sha256, ext) of a URL whose bytes are already in the store
+        if self._urls is not None:
+            found = self._urls.get(url)
+        else:
+            found = self.state.media_for_url(url)
+        if found is not None and os.path.isfile(self.object_path(*found)):
+            return found
+        return None
+
+    def _record(self, url, sha256, ext, size):
+        if self._urls is not None:
+            self._urls[url] = (sha256, ext)
+        else:
+            self.state.record_media_url(url, sha256, ext, size)
+
+    def _commit_object(self, tmp_name, sha256, ext):
+        object_path = self.object_path(sha256, ext)
+        size = os.path.getsize(tmp_name)
+        if os.path.isfile(object_path):
+            # Identical bytes already stored under another URL
+            os.remove(tmp_name)
+        else:
+            os.makedirs(os.path.dirname(object_path), exist_ok=True)
+            os.replace(tmp_name, object_path)
+        return size
+
+    async def fetch(self, session, scheduler, url, ext):
+        # Returns the sha256 of the URL's bytes, downloading them only once.
+        # Once its status has expired, a stored URL is revalidated with a
+        # conditional GET, and a changed file is stored from that response.
+        found = self.lookup(url)
+        validators = None
+        if found is not None:
+            url_status = scheduler.url_status
+            validators = url_status.validators(url) if url_status is not None else None
+            if validators is None:
+                return found[0]
+        if url in self._inflight:
+            return await self._inflight[url]
+        future = self._inflight[url] = asyncio.get_running_loop().create_future()
+        try:
+            # Named by URL so an interrupted download resumes from its .part file
+            tmp_name = os.path.join(self.root, 'tmp', f"{hashlib.sha1(url.encode()).hexdigest()}.{ext}")
+            sha256 = await download_image(session, url, tmp_name, scheduler, validators) or None
+            if found is not None and sha256 in (None, NOT_MODIFIED):
+                # Unchanged, or gone or unreachable upstream; either way the
+                # stored copy stays
+                sha256 = found[0]
+            elif sha256 is not None:
+                if found is not None and sha256 != found[0]:
+                    print(f"[~] {url} changed since it was stored")
+                size = await scheduler.workers.io(self._commit_object, tmp_name, sha256, ext)
+                self._record(url, sha256, ext, size)
+            future.set_result(sha256)
+            return sha256
+        except BaseException as e:
+            future.set_exception(e)
+            future.exception()  # only waiters on the same URL need to see it
+            raise
+        finally:
+            del self._inflight[url]
+
+    async def link(self, scheduler, sha256, ext, target):
+        # A copy (where links aren't supported) opens both files
+        async with scheduler.files:
+            await scheduler.workers.io(link_file, self.object_path(sha256, ext), target)
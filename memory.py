@@ -0,0 +1,60 @@
+import gc
+import os
+import sys
+
+# --low-memory's hard ceiling on the crawler's resident memory (RSS). Before
+# taking each timeline page a user's crawl checks it; over the limit, it lets
+# its pages in flight finish and collects garbage, and if the process is
+# still over, the crawl stops as interrupted (--resume continues it) instead
+# of growing any further.
+LOW_MEMORY_LIMIT_MB = 256
+
+
+def current_rss_mb():
+    # None where it can't be read
+    if sys.platform.startswith('linux'):
+        with open('/proc/self/statm') as statm:
+            return int(statm.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / 2 ** 20
+    if sys.platform == 'win32':
+        return _windows_rss_mb()
+    try:
+        import resource
+    except ImportError:
+        return None
+    # Only the peak is available elsewhere; it is an upper bound of the RSS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / 2 ** 20 if sys.platform == 'darwin' else peak / 1024
+
+
+def _windows_rss_mb():
+    import ctypes
+    from ctypes import wintypes
+
+    class ProcessMemoryCounters(ctypes.Structure):
+        _fields_ = [('cb', wintypes.DWORD), ('PageFaultCount', wintypes.DWORD),
+                    ('PeakWorkingSetSize', ctypes.c_size_t), ('WorkingSetSize', ctypes.c_size_t),
+                    ('QuotaPeakPagedPoolUsage', ctypes.c_size_t), ('QuotaPagedPoolUsage', ctypes.c_size_t),
+                    ('QuotaPeakNonPagedPoolUsage', ctypes.c_size_t), ('QuotaNonPagedPoolUsage', ctypes.c_size_t),
+                    ('PagefileUsage', ctypes.c_size_t), ('PeakPagefileUsage', ctypes.c_size_t)]
+
+    kernel32 = ctypes.windll.kernel32
+    kernel32.GetCurrentProcess.restype = wintypes.HANDLE
+    get_info = ctypes.windll.psapi.GetProcessMemoryInfo
+    get_info.argtypes = [wintypes.HANDLE, ctypes.POINTER(ProcessMemoryCounters), wintypes.DWORD]
+    counters = ProcessMemoryCounters()
+    counters.cb = ctypes.sizeof(counters)
+    if not get_info(kernel32.GetCurrentProcess(), ctypes.byref(counters), counters.cb):
+        return None
+    return counters.WorkingSetSize / 2 ** 20
+
+
+class MemoryLimit:
+    def __init__(self, limit_mb=LOW_MEMORY_LIMIT_MB):
+        self.limit_mb = limit_mb
+
+    def exceeded(self, collect=False):
+        # The RSS in MB when it is over the limit, else None
+        if collect:
+            gc.collect()
+        rss = current_rss_mb()
+        return rss if rss is not None and rss > self.limit_mb else None
@@ -0,0 +1,60 @@
+import hmac
+import time
+import base64
+import hashlib
+import secrets
+from urllib.parse import quote
+from ratelimit import parse_retry_after
+
+PLURK_BASE_URL = 'https://www.plurk.com'
+
+
+def _escape(value):
+    return quote(str(value), safe='~')
+
+
+class AsyncPlurkAPI:
+    # OAuth 1.0a (HMAC-SHA1) client for the Plurk API endpoints the crawler
+    # uses, sending form-encoded POSTs over the shared aiohttp session the
+    # same way plurk_oauth.PlurkAPI does, without a thread per request.
+    def __init__(self, session, consumer_key, consumer_secret, access_token, access_token_secret,
+                 base_url=PLURK_BASE_URL):
+        self.session = session
+        self.consumer_key = consumer_key
+        self.consumer_secret = consumer_secret
+        self.access_token = access_token
+        self.access_token_secret = access_token_secret
+        self.base_url = base_url.rstrip('/')
+
+    def _authorization(self, url, params, nonce=None, timestamp=None):
+        oauth_params = {
+            'oauth_consumer_key': self.consumer_key,
+            'oauth_nonce': nonce or secrets.token_hex(16),
+            'oauth_signature_method': 'HMAC-SHA1',
+            'oauth_timestamp': str(timestamp or int(time.time())),
+            'oauth_token': self.access_token,
+            'oauth_version': '1.0',
+        }
+        pairs = sorted((_escape(k), _escape(v)) for k, v in {**params, **oauth_params}.items())
+        normalized = '&'.join(f'{k}={v}' for k, v in pairs)
+        base_string = '&'.join(('POST', _escape(url), _escape(normalized)))
+        key = f'{_escape(self.consumer_secret)}&{_escape(self.access_token_secret)}'
+        digest = hmac.new(key.encode(), base_string.encode(), hashlib.sha1).digest()
+        oauth_params['oauth_signature'] = base64.b64encode(digest).decode()
+        return 'OAuth ' + ', '.join(f'{_escape(k)}="{_escape(v)}"' for k, v in oauth_params.items())
+
+    async def request(self, path, options=None):
+        # Returns (status, json or None, retry_after seconds or None)
+        url = self.base_url + path
+        params = {k: str(v) for k, v in (options or {}).items()}
+        headers = {'Authorization': self._authorization(url, params)}
+        async with self.session.post(url, data=params, headers=headers) as response:
+            try:
+                rawJson = await response.json(content_type=None)
+            except ValueError:
+                rawJson = None
+            return response.status, rawJson, parse_retry_after(response.headers.get('Retry-After'))
+
+    async def callAPI(self, path, options=None):
+        status, rawJson, _ = await self.request(path, options)
+        return rawJson if status == 200 else None
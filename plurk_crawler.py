@@ -1,17 +1,20 @@
 import os
-import re
 import sys
 import time
-import calendar
 import base36
-import aiohttp
 import asyncio
-import aiomultiprocess
-from functools import partial
-from plurk_oauth import PlurkAPI
+import collections
+from plurk_api import AsyncPlurkAPI
 from time import gmtime, strftime
 from dotenv import load_dotenv
-from utils import url_exists, download_image, url_validation_pattern as url_validation_regex
+from crawl_state import CrawlState
+from scheduler import Scheduler
+from ratelimit import API_MAX_RETRIES, RETRYABLE_STATUS, backoff_delay
+from archive import open_archive, DEFAULT_STORAGE, ARCHIVE_STORAGES
+from media_store import MediaStore
+from file_index import FileIndex
+from utils import (create_session, download_image, write_text, write_texts, hash_file,
+                   parse_posted, posted_to_epoch, extract_media_links)
 
 # Load environment variables
 load_dotenv()
@@ -22,181 +25,564 @@ CONSUMER_SECRET = os.getenv("CONSUMER_SECRET")
 ACCESS_TOKEN = os.getenv("ACCESS_TOKEN")
 ACCESS_TOKEN_SECRET = os.getenv("ACCESS_TOKEN_SECRET")
 
-async def getPublicPlurks(plurk, _id, time_Offset):
-    try:
-        rawJson = await asyncio.to_thread(partial(plurk.callAPI,
-                                                  '/APP/Timeline/getPublicPlurks',
-                                                  {'user_id': _id, 'offset': time_Offset, 'limit': 30,
-                                                   'favorers_detail': False, 'limited_detail': False, 'replurkers_detail': False}))
-        return rawJson['plurks']
-    except Exception as e:
-        print(f"An error occurred while fetching public plurks: {e}")
-        return []
-
-async def parsePostsJob(plurk, i, owner_id, userName, lowStandardFav):
+# A post whose media could not all be downloaded is still archived, but it
+# is recorded as failed (not as archived) and fetched again on the next runs,
+# up to FAILED_POST_RETRIES times, since it is usually below the checkpoint
+# by then. Dead links (404/410) don't count as failures.
+MEDIA_FAILED = 'media'
+# Same for a post the API refuses outright (HTTP 4xx for a deleted or
+# restricted plurk): it can't be archived in full, but it must not stop the
+# checkpoint from moving on every run.
+REJECTED = 'rejected'
+FAILED_POST_RETRIES = 5
+
+def _media_failure(scheduler, url):
+    url_status = scheduler.url_status
+    return None if url_status is not None and url_status.gone(url) else False
+
+async def fetchMedia(session, scheduler, url, image_name, archive, store=None, files=None):
+    # Returns the sha256 of the media file when it is known or needed by an
+    # archive, and False when the download failed
+    imageNameWithoutPath = os.path.basename(image_name)
+    if files is not None:
+        existing = files.find(image_name)
+    else:
+        existing = image_name if os.path.isfile(image_name) else None
+    if existing is not None:
+        print(f"[✗] {imageNameWithoutPath} was already downloaded.")
+        if archive is None:
+            return None
+        async with scheduler.files:
+            return await scheduler.workers.cpu(hash_file, existing)
+    if store is None:
+        print(f'[✓] downloading {imageNameWithoutPath}')
+        sha256 = await download_image(session, url, image_name, scheduler)
+        if not sha256:
+            return _media_failure(scheduler, url)
+        if files is not None:
+            files.add(image_name)
+        return sha256
+
+    ext = image_name.rsplit('.', 1)[-1]
+    if store.lookup(url) is None:
+        print(f'[✓] downloading {imageNameWithoutPath}')
+    else:
+        print(f"[=] {imageNameWithoutPath} is already in the media store.")
+    sha256 = await store.fetch(session, scheduler, url, ext)
+    if sha256 is None:
+        return _media_failure(scheduler, url)
+    # Archives reference the stored object by hash; the files layout gets
+    # the legacy name as a link to it.
+    if archive is None:
+        await store.link(scheduler, sha256, ext, image_name)
+        if files is not None:
+            files.add(image_name)
+    return sha256
+
+async def parsePostsJob(plurk, session, scheduler, i, owner_id, userName, lowStandardFav, archive=None, store=None,
+                        owner_responses_only=False, files=None):
     image_path = f'./{userName}/'
     thisPostMediaCount = 0
-    async with aiohttp.ClientSession() as session:
-        if i['owner_id'] != owner_id:
-            return
+    if i['owner_id'] != owner_id:
+        return
+
+    # A post without responses costs no /APP/Responses/get call
+    responses_result = True
+    if i['favorite_count'] > lowStandardFav and i.get('response_count', 1) > 0:
+        responses_result = await getResponsesJob(plurk, session, scheduler, i['plurk_id'], owner_id, userName,
+                                                 archive, store, owner_responses_only, i.get('response_count'), files)
+        if responses_result is False:
+            return False
+        # REJECTED: the post itself is still archived below
 
-        if i['favorite_count'] > lowStandardFav:
-            await getResponsesJob(plurk, session, i['plurk_id'], owner_id, userName)
-
-        owner_id_str = str(owner_id)
-        base36_plurk_id = str(base36.dumps(i['plurk_id']))
-
-        splitStr = i['posted'].split()
-        abbr_to_num = {name: num for num, name in enumerate(calendar.month_abbr) if num}
-        fileNameTime = splitStr[3] + '_' + str(abbr_to_num[splitStr[2]]) + '_' + splitStr[1]
-
-        _list = i['content'].split()
-        tasks = []
-        for content in _list:
-            if content.startswith('href'):
-                content = content[:-1]
-                supported_format = ['jpg', 'png', 'gif', 'mp4', 'webp', 'bmp', 'svg']
-                if content[-3:] in supported_format:
-                    if re.match(url_validation_regex, str(content[6:])) is None:
-                        continue
-                    if not await url_exists(session, str(content[6:])):  # Changed urlExists to url_exists
-                        continue
-                    thisPostMediaCount += 1
-                    imageNameWithoutPath = f"{fileNameTime}-plurk-{base36_plurk_id}-{thisPostMediaCount}-{owner_id_str}.{content[-3:]}"
-                    image_name = image_path + imageNameWithoutPath
-                    if os.path.isfile(image_name):
-                        print(f"[✗] {imageNameWithoutPath} was already downloaded.")
-                        continue
-                    print(f'[✓] downloading {imageNameWithoutPath}')
-                    tasks.append(download_image(session, str(content[6:]), image_name))
-            else:
-                # Saving text content
-                text_content = content.strip()
-                with open(f"{image_path}{fileNameTime}-plurk-{base36_plurk_id}-text.txt", "a", encoding="utf-8") as text_file:
-                    text_file.write(text_content + "\n")
-        await asyncio.gather(*tasks)
-
-async def getResponsesJob(plurk, session, pID, owner_id, userName):
+    owner_id_str = str(owner_id)
+    base36_plurk_id = str(base36.dumps(i['plurk_id']))
+
+    fileNameTime = parse_posted(i['posted']).file_date
+
+    media = []
+    tasks = []
+    for link, ext in extract_media_links(i['content']):
+        thisPostMediaCount += 1
+        imageNameWithoutPath = f"{fileNameTime}-plurk-{base36_plurk_id}-{thisPostMediaCount}-{owner_id_str}.{ext}"
+        image_name = image_path + imageNameWithoutPath
+        media.append({'url': link, 'file': imageNameWithoutPath})
+        tasks.append(fetchMedia(session, scheduler, link, image_name, archive, store, files))
+    hashes = await asyncio.gather(*tasks)
+
+    started = time.perf_counter()
+    if archive is not None:
+        for entry, sha256 in zip(media, hashes):
+            entry['sha256'] = sha256 or None
+        archive.save_plurk(i, media)
+    else:
+        # Saving text content: the original post content in one write
+        text_content = i['content'].strip()
+        async with scheduler.files:
+            await scheduler.workers.io(write_text, f"{image_path}{fileNameTime}-plurk-{base36_plurk_id}-text.txt",
+                                       text_content + "\n")
+    scheduler.events.emit('disk_write', what='post', seconds=time.perf_counter() - started)
+    if responses_result == REJECTED:
+        return REJECTED
+    if responses_result == MEDIA_FAILED or False in hashes:
+        return MEDIA_FAILED
+    return True
+
+async def getResponsesJob(plurk, session, scheduler, pID, owner_id, userName, archive=None, store=None,
+                          owner_responses_only=False, expected_count=None, files=None):
     owner_id_str = str(owner_id)
     image_path = f'./{userName}/'
     base36_plurk_id = str(base36.dumps(pID))
-    res_raw_json = await getResponses(plurk, pID)
+    res_raw_json = await getResponses(plurk, scheduler, pID, expected_count)
+    if res_raw_json is None:
+        return False
+    if res_raw_json == REJECTED:
+        return REJECTED
     response_count = 0
     thisPostMediaCount = 0
 
     tasks = []
+    texts = []
+    responseMedia = []
     for j in res_raw_json['responses']:
         response_count += 1
-        splitStr = j['posted'].split()
-        abbr_to_num = {name: num for num, name in enumerate(calendar.month_abbr) if num}
-        fileNameTime = splitStr[3] + '_' + str(abbr_to_num[splitStr[2]]) + '_' + splitStr[1]
-        content_str = j['content']
-        match = re.findall(r"href=\S+", content_str)
-        matchList = []
-        for matchCase in match:
-            matchCase = matchCase[:-1]
-            matchCase = matchCase[6:]
-            matchList.append(matchCase)
-        for responseLink in matchList:
-            supported_format = ['jpg', 'png', 'gif', 'mp4', 'webp', 'bmp', 'svg']
-            if responseLink[-3:] in supported_format:
-                if re.match(url_validation_regex, responseLink) is None:
-                    print(f"Invalid URL: {responseLink}")
-                    continue
-                if not await url_exists(session, responseLink):  # Changed urlExists to url_exists
-                    print(f"URL does not exist: {responseLink}")
-                    continue
-                thisPostMediaCount += 1
-                imageNameWithoutPath = f"{fileNameTime}-plurk-{base36_plurk_id}-{thisPostMediaCount}-response-{response_count}-{owner_id_str}.{responseLink[-3:]}"
-                image_name = image_path + imageNameWithoutPath
-                if os.path.isfile(image_name):
-                    print(f"[✗] {imageNameWithoutPath} was already downloaded.")
-                    continue
-                print(f'[✓] downloading {imageNameWithoutPath}')
-                tasks.append(download_image(session, responseLink, image_name))
-        
+        if owner_responses_only and j.get('user_id') != owner_id:
+            # Skipped, but numbered as in a full backup so file names match
+            thisPostMediaCount += len(extract_media_links(j['content']))
+            continue
+        fileNameTime = parse_posted(j['posted']).file_date
+        media = []
+        for responseLink, ext in extract_media_links(j['content']):
+            thisPostMediaCount += 1
+            imageNameWithoutPath = f"{fileNameTime}-plurk-{base36_plurk_id}-{thisPostMediaCount}-response-{response_count}-{owner_id_str}.{ext}"
+            image_name = image_path + imageNameWithoutPath
+            media.append({'url': responseLink, 'file': imageNameWithoutPath})
+            tasks.append(fetchMedia(session, scheduler, responseLink, image_name, archive, store, files))
+        responseMedia.append((j, media))
+
         # Saving text content
         text_content = j['content'].strip()
-        with open(f"{image_path}{fileNameTime}-plurk-{base36_plurk_id}-response-{response_count}-text.txt", "a", encoding="utf-8") as text_file:
-            text_file.write(text_content + "\n")
-            
-    await asyncio.gather(*tasks)
+        texts.append((f"{image_path}{fileNameTime}-plurk-{base36_plurk_id}-response-{response_count}-text.txt",
+                      text_content + "\n"))
 
+    hashes = await asyncio.gather(*tasks)
+    started = time.perf_counter()
+    if archive is not None:
+        remaining = iter(hashes)
+        for j, media in responseMedia:
+            for entry in media:
+                entry['sha256'] = next(remaining) or None
+            archive.save_response(pID, j, media)
+    else:
+        # One worker round trip writes every response file of the thread, one
+        # file open at a time
+        async with scheduler.files:
+            await scheduler.workers.io(write_texts, texts)
+    scheduler.events.emit('disk_write', what='responses', seconds=time.perf_counter() - started)
+    return MEDIA_FAILED if False in hashes else True
             
-async def getResponses(plurk, pID):
-    try:
-        rawJson = await asyncio.to_thread(partial(plurk.callAPI,
-                                                  '/APP/Responses/get',
-                                                  {'plurk_id': pID}))
-        return rawJson
-    except Exception as e:
-        print(f"An error occurred while fetching responses: {e}")
-        return {}
+# Timeline pagination: the API returns at most 30 plurks per call. The
+# producer runs up to PREFETCH_PAGES pages ahead of the consumer (a bounded
+# queue, so memory stays flat on huge timelines) and the consumer keeps up
+# to PAGES_IN_FLIGHT pages of posts processing at once.
+PAGE_SIZE = 30
+PREFETCH_PAGES = 2
+PAGES_IN_FLIGHT = 2
+
+# Partial backups: only plurks posted in [since, until) (epoch seconds) that
+# pass the filters are archived. The timeline is paginated from `until` and
+# stops once a page reaches `since`; filtered posts never reach the consumer,
+# so their responses and media cost no requests.
+class CrawlFilter:
+    def __init__(self, since=None, until=None, media_only=False, min_favorites=0, owner_responses_only=False):
+        self.since = since
+        self.until = until
+        self.media_only = media_only
+        self.min_favorites = min_favorites
+        self.owner_responses_only = owner_responses_only
+
+    @property
+    def partial(self):
+        return (self.since is not None or self.until is not None or self.media_only
+                or self.min_favorites > 0 or self.owner_responses_only)
+
+    def accepts(self, plurk):
+        if self.since is not None and posted_to_epoch(plurk['posted']) < self.since:
+            return False
+        if plurk.get('favorite_count', 0) < self.min_favorites:
+            return False
+        if self.media_only and not extract_media_links(plurk['content']):
+            return False
+        return True
+
+# Per-user progress, updated as pages are checkpointed; the batch runner
+# prints it and builds its completion report from it.
+class UserProgress:
+    def __init__(self, user_name):
+        self.user_name = user_name
+        self.status = 'pending'
+        self.pages = 0
+        self.plurks = 0
+        self.started = None
+        self.finished = None
+
+# Every Plurk API call goes through the scheduler's rate limiter and is
+# retried on throttling, server errors and network failures. Only when the
+# retries are exhausted is None returned; when the API rejects the request
+# (a status that is not retried) `rejected` is, None by default.
+async def callAPI(plurk, scheduler, path, options, rejected=None):
+    limiter = scheduler.rate_limiter
+    events = scheduler.events
+    for attempt in range(API_MAX_RETRIES + 1):
+        queued = time.perf_counter()
+        await limiter.acquire()
+        started = time.perf_counter()
+        try:
+            async with scheduler.api:
+                status, rawJson, retry_after = await plurk.request(path, options)
+            reason = status
+        except Exception as e:
+            status, rawJson, retry_after, reason = None, None, None, e
+        events.emit('api_call', path=path, status=status, attempt=attempt, wait=started - queued,
+                    seconds=time.perf_counter() - started)
+        if status == 200:
+            limiter.record_success()
+            return rawJson
+        if status is not None and status not in RETRYABLE_STATUS:
+            print(f"Plurk API {path} failed with HTTP {status}: {rawJson}")
+            return rejected
+        limiter.record_failure(status, retry_after)
+        if attempt < API_MAX_RETRIES:
+            delay = backoff_delay(attempt, retry_after)
+            print(f"Plurk API {path} failed ({reason}), retrying in {delay:.1f}s")
+            events.emit('api_retry', path=path, reason=str(reason), attempt=attempt, delay=delay)
+            await asyncio.sleep(delay)
+    print(f"Plurk API {path} still failing after {API_MAX_RETRIES + 1} attempts, giving up")
+    return None
+
+# API helpers return None when the call failed, so callers can tell an error
+# apart from an empty result (e.g. the real end of the timeline);
+# getResponses returns REJECTED when the API refuses the plurk.
+# Long threads come back in pages; the rest is requested with from_response
+# until the thread's response_count is reached. A page with nothing new ends
+# the loop too, so a server that ignores from_response can't make it spin.
+async def getResponses(plurk, scheduler, pID, response_count=None):
+    responses = []
+    seen = set()
+    while True:
+        options = {'plurk_id': pID}
+        if responses:
+            options['from_response'] = len(responses)
+        rawJson = await callAPI(plurk, scheduler, '/APP/Responses/get', options, REJECTED)
+        if rawJson is None or rawJson == REJECTED:
+            return rawJson
+        page = [j for j in rawJson.get('responses', []) if j['id'] not in seen]
+        seen.update(j['id'] for j in page)
+        responses.extend(page)
+        total = rawJson.get('response_count', response_count)
+        if not page or total is None or len(responses) >= total:
+            break
+    rawJson['responses'] = responses
+    return rawJson
 
                         
-async def getPublicPlurks(plurk, _id, time_Offset, limit=30):
-    try:
-        rawJson = await asyncio.to_thread(partial(plurk.callAPI,
-                                                  '/APP/Timeline/getPublicPlurks',
-                                                  {'user_id': _id, 'offset': time_Offset, 'limit': limit,
-                                                   'favorers_detail': False, 'limited_detail': False, 'replurkers_detail': False}))
-        return rawJson['plurks']
-    except Exception as e:
-        print(f"An error occurred while fetching public plurks: {e}")
-        return []
+async def getPublicPlurks(plurk, scheduler, _id, time_Offset, limit=PAGE_SIZE):
+    rawJson = await callAPI(plurk, scheduler, '/APP/Timeline/getPublicPlurks',
+                            {'user_id': _id, 'offset': time_Offset, 'limit': limit,
+                             'favorers_detail': False, 'limited_detail': False, 'replurkers_detail': False})
+    if rawJson is None:
+        return None
+    return rawJson['plurks']
         
-async def process_user(plurk, user_name):
-    public_profile = plurk.callAPI('/APP/Profile/getPublicProfile', {'user_id': user_name})
-    if public_profile is None:
+async def process_user(plurk, session, user_name, state=None, full=False, resume=False, scheduler=None,
+                       page_size=PAGE_SIZE, prefetch_pages=PREFETCH_PAGES, storage=DEFAULT_STORAGE, store=None, crawl_filter=None,
+                       progress=None, low_memory=False, refetch=False):
+    if scheduler is None:
+        scheduler = Scheduler()
+    if crawl_filter is None:
+        crawl_filter = CrawlFilter()
+    if progress is None:
+        progress = UserProgress(user_name)
+    events = scheduler.events
+    progress.status = 'running'
+    progress.started = time.time()
+
+    def finish(status):
+        progress.status = status
+        progress.finished = time.time()
+        events.emit('user_finished', user=user_name, status=status, pages=progress.pages, plurks=progress.plurks,
+                    seconds=progress.finished - progress.started)
+        return status == 'completed'
+
+    page_size = max(1, min(page_size, PAGE_SIZE))
+    public_profile = await callAPI(plurk, scheduler, '/APP/Profile/getPublicProfile', {'user_id': user_name}, REJECTED)
+    if public_profile == REJECTED:
         print(f'User {user_name} Not Found!')
-        return
+        return finish('not found')
+    if public_profile is None:
+        # Retries ran out on network or server errors; the user may well exist
+        print(f'Could not look up {user_name}, run the backup again later.')
+        return finish('failed')
 
     user_id = public_profile['user_info']['id']
+    plurks_count = public_profile.get('plurks_count', public_profile['user_info'].get('plurks_count'))
     path = f'./{user_name}'
     
     if not os.path.exists(path):
         os.mkdir(path)
-    timeOffset = strftime("%Y-%m-%dT%H:%M:%S", gmtime())
+    # The file index holds the name of every media file saved for the user;
+    # --low-memory checks each link on disk instead
+    files = None if low_memory else await scheduler.workers.io(FileIndex, path)
+    timeOffset = strftime("%Y-%m-%dT%H:%M:%S", gmtime(crawl_filter.until))
+
+    # With a state store, stop paginating once we pass the newest plurk of the
+    # last completed crawl; older posts are already archived. --full walks the
+    # whole timeline but still skips posts whose response count is unchanged,
+    # --refetch archives every post again.
+    checkpoint = None if state is None or full else state.newest_posted(user_id)
+    newest_seen = None
+
+    # A partial backup neither resumes nor saves progress, and never moves
+    # the checkpoint: the posts it skips are not archived.
+    track_progress = state is not None and not crawl_filter.partial
+    saved_progress = None if not track_progress or not resume else state.progress(user_id)
+    if saved_progress is not None:
+        timeOffset, checkpoint, newest_seen = saved_progress
+        print(f'{user_name}: resuming interrupted crawl from {timeOffset}')
+    lower_bound = max((bound for bound in (checkpoint, crawl_filter.since) if bound is not None), default=None)
+    # Only a walk over the whole timeline is known to cover plurks_count posts;
+    # incremental, resumed and partial runs don't know their size up front
+    whole_timeline = lower_bound is None and saved_progress is None and not crawl_filter.partial
+    events.emit('user_started', user=user_name, user_id=user_id, plurks_count=plurks_count,
+                expected_plurks=plurks_count if whole_timeline else None)
+    interrupted = False
+    # Set when the crawl stops on the --low-memory limit
+    memory_stop = False
 
     # store json_data
-    json_data_queue = asyncio.Queue()
+    json_data_queue = asyncio.Queue(maxsize=max(1, prefetch_pages))
 
+    # Each queued page carries the offset it was fetched with and the offset of
+    # the page after it, so the consumer can checkpoint once the page is done.
     async def producer():
-        nonlocal timeOffset
-        while True:
-            json_data = await getPublicPlurks(plurk, user_id, timeOffset)
-            if len(json_data) == 0:
-                await json_data_queue.put(None) 
-                break
-            await json_data_queue.put(json_data)
-            splitStr = json_data[-1]['posted'].split()
-            abbr_to_num = {name: num for num, name in enumerate(calendar.month_abbr) if num}
-            timeOffset = f"{splitStr[3]}-{abbr_to_num[splitStr[2]]}-{splitStr[1]}T{splitStr[4]}"
+        nonlocal timeOffset, newest_seen, interrupted
+        try:
+            while True:
+                started = time.perf_counter()
+                json_data = await getPublicPlurks(plurk, scheduler, user_id, timeOffset, page_size)
+                if json_data is None:
+                    interrupted = True
+                    break
+                if len(json_data) == 0:
+                    break
+                if newest_seen is None:
+                    newest_seen = max(posted_to_epoch(i['posted']) for i in json_data)
+                nextOffset = parse_posted(json_data[-1]['posted']).offset
+                reached_end = lower_bound is not None and posted_to_epoch(json_data[-1]['posted']) < lower_bound
+                if reached_end:
+                    json_data = [i for i in json_data if posted_to_epoch(i['posted']) >= lower_bound]
+                if crawl_filter.partial:
+                    json_data = [i for i in json_data if crawl_filter.accepts(i)]
+                fetched = time.perf_counter()
+                if json_data:
+                    await json_data_queue.put((json_data, timeOffset, nextOffset))
+                events.emit('page_fetched', user=user_name, plurks=len(json_data), offset=timeOffset,
+                            queue_depth=json_data_queue.qsize(), seconds=fetched - started,
+                            put_wait=time.perf_counter() - fetched)
+                if reached_end:
+                    if lower_bound == checkpoint:
+                        print(f'{user_name}: reached the last checkpoint, older posts are already archived.')
+                    else:
+                        print(f'{user_name}: reached --since, older posts are not part of this backup.')
+                    break
+                timeOffset = nextOffset
+        except Exception as e:
+            print(f"An error occurred while paginating {user_name}: {e}")
+            interrupted = True
+        await json_data_queue.put(None)
+
+    # Responses are fetched for posts with more favorites than this
+    lowStandardFav = crawl_filter.min_favorites - 1
+
+    # A post only counts as completed (and is recorded in the state store) once
+    # its responses were fetched; a failed post is retried on --resume. A post
+    # whose media failed doesn't stop the crawl but is retried on later runs.
+    async def archivePost(i, retry=False):
+        started = time.perf_counter()
+        known_response_count = None if state is None or refetch or retry else state.response_count(user_id, i['plurk_id'])
+        if known_response_count is None:
+            completed = await parsePostsJob(plurk, session, scheduler, i, user_id, user_name, lowStandardFav,
+                                            archive, store, crawl_filter.owner_responses_only, files)
+            if completed is None:
+                # Not the user's own plurk, nothing to archive
+                completed = True
+        elif known_response_count != i.get('response_count', 0):
+            # Already archived; only the conversation changed since last run.
+            completed = True
+            if i['owner_id'] == user_id and i['favorite_count'] > lowStandardFav and i.get('response_count', 0) > 0:
+                completed = await getResponsesJob(plurk, session, scheduler, i['plurk_id'], user_id, user_name,
+                                                  archive, store, crawl_filter.owner_responses_only,
+                                                  i.get('response_count'), files)
+        else:
+            # Unchanged since the last run
+            completed = None
+        if state is not None:
+            # --owner-responses-only leaves responses out, so the post must
+            # not look archived (response_count and all) to a later full run
+            if completed is True and not crawl_filter.owner_responses_only:
+                state.record_post(user_id, i['plurk_id'], posted_to_epoch(i['posted']), i.get('response_count', 0))
+            elif completed == MEDIA_FAILED or completed == REJECTED:
+                state.record_failed_post(user_id, i['plurk_id'], completed)
+        events.emit('post_done', user=user_name, plurk_id=i['plurk_id'], ok=completed is True or completed is None,
+                    skipped=completed is None, seconds=time.perf_counter() - started)
+        return completed is not False
+
+    # Posts that failed on earlier runs are usually below the checkpoint, so
+    # they are fetched again by id once the timeline is done
+    earlier_failures = set(state.failed_posts(user_id, FAILED_POST_RETRIES)) if track_progress else set()
+
+    async def retryFailedPosts():
+        # Those archived by this run's timeline walk are no longer listed
+        plurk_ids = [plurk_id for plurk_id in state.failed_posts(user_id, FAILED_POST_RETRIES)
+                     if plurk_id in earlier_failures]
+        if not plurk_ids:
+            return
+
+        async def retry(plurk_id):
+            rawJson = await callAPI(plurk, scheduler, '/APP/Timeline/getPlurk', {'plurk_id': plurk_id}, REJECTED)
+            if rawJson is None:
+                # Transient; tried again next run without using up an attempt
+                return False
+            if rawJson == REJECTED or 'plurk' not in rawJson:
+                state.record_failed_post(user_id, plurk_id, REJECTED)
+                return False
+            return await archivePost(rawJson['plurk'], retry=True)
+
+        print(f'{user_name}: retrying {len(plurk_ids)} posts that failed on earlier runs')
+        await asyncio.gather(*[retry(plurk_id) for plurk_id in plurk_ids])
+        if archive is not None:
+            archive.commit()
+        state.commit()
 
     async def consumer():
-        lowStandardFav = -1
-        async with aiomultiprocess.Pool() as pool:
+        nonlocal interrupted, memory_stop
+        # The resume offset stops at the first page with a failed post, so
+        # resuming re-reads that page and skips the posts that did complete.
+        failed_page = False
+        # Pages are processed concurrently but checkpointed strictly in order.
+        in_flight = collections.deque()
+
+        async def finishPage(page):
+            nonlocal interrupted, failed_page
+            pageTasks, pageOffset, nextOffset, pageStarted, slotWait, queueWait = page
+            results = await pageTasks
+            if not all(results):
+                interrupted = True
+                if not failed_page:
+                    failed_page = True
+                    if track_progress:
+                        state.save_progress(user_id, pageOffset, checkpoint, newest_seen)
+            elif not failed_page and track_progress:
+                state.save_progress(user_id, nextOffset, checkpoint, newest_seen)
+            committed = time.perf_counter()
+            if archive is not None:
+                archive.commit()
+            if state is not None:
+                state.commit()
+            events.emit('disk_write', what='commit', seconds=time.perf_counter() - committed)
+            progress.pages += 1
+            progress.plurks += len(results)
+            print(f'{user_name}: {progress.pages} pages, {progress.plurks} plurks done')
+            events.emit('page_done', user=user_name, pages=progress.pages, plurks=progress.plurks,
+                        failed=results.count(False), queue_wait=queueWait, slot_wait=slotWait,
+                        seconds=time.perf_counter() - pageStarted)
+
+        try:
             while True:
-                json_data = await json_data_queue.get()
-                if json_data is None:  
+                getStarted = time.perf_counter()
+                item = await json_data_queue.get()
+                if item is None:
                     break
-                tasks = [pool.apply(parsePostsJob, (plurk, i, user_id, user_name, lowStandardFav)) for i in json_data]
-                await asyncio.gather(*tasks)
+                json_data, pageOffset, nextOffset = item
+                if scheduler.memory_limit is not None and scheduler.memory_limit.exceeded():
+                    # Let the pages in flight finish and free what they hold
+                    while in_flight:
+                        await finishPage(in_flight.popleft())
+                    rss = scheduler.memory_limit.exceeded(collect=True)
+                    if rss is not None:
+                        print(f'{user_name}: memory use {rss:.0f} MB is over the '
+                              f'{scheduler.memory_limit.limit_mb} MB limit, stopping the crawl.')
+                        interrupted = memory_stop = True
+                        break
+                # Users take turns for the shared page slots; a slot is freed as
+                # soon as the page's posts are done, not when it's checkpointed.
+                waitStarted = time.perf_counter()
+                await scheduler.pages.acquire(user_name)
+                pageStarted = time.perf_counter()
+                pageTasks = asyncio.gather(*[archivePost(i) for i in json_data])
+                pageTasks.add_done_callback(lambda _: scheduler.pages.release())
+                in_flight.append((pageTasks, pageOffset, nextOffset, pageStarted,
+                                  pageStarted - waitStarted, waitStarted - getStarted))
+                if len(in_flight) >= PAGES_IN_FLIGHT:
+                    await finishPage(in_flight.popleft())
+            while in_flight:
+                await finishPage(in_flight.popleft())
+        finally:
+            # Pages still in flight here were abandoned by an error
+            for pageTasks, *_ in in_flight:
+                pageTasks.cancel()
 
+    # An archive file stays open for the whole crawl and holds one of the
+    # scheduler's open file slots until it is closed
+    if storage in ARCHIVE_STORAGES:
+        await scheduler.files.acquire()
+    try:
+        archive = open_archive(storage, path)
+    except BaseException:
+        if storage in ARCHIVE_STORAGES:
+            scheduler.files.release()
+        raise
     producer_task = asyncio.create_task(producer())
-    await consumer()
+    try:
+        await consumer()
+        if not memory_stop:
+            await producer_task
+        if earlier_failures and not interrupted:
+            await retryFailedPosts()
+    finally:
+        if not producer_task.done():
+            producer_task.cancel()
+        if archive is not None:
+            archive.close()
+            scheduler.files.release()
+    await asyncio.gather(producer_task, return_exceptions=True)
+    if interrupted:
+        if crawl_filter.partial:
+            print(f'{user_name}: crawl interrupted, run the same backup again to continue; archived posts are skipped.')
+        else:
+            print(f'{user_name}: crawl interrupted before the end of the timeline, run again with --resume to continue.')
+        return finish('interrupted')
+    if track_progress:
+        state.finish_user(user_id, user_name, newest_seen)
+    return finish('completed')
             
 async def main():
-    plurk = PlurkAPI(CONSUMER_KEY, CONSUMER_SECRET)
-    plurk.authorize(ACCESS_TOKEN, ACCESS_TOKEN_SECRET)
-
     if len(sys.argv) == 1:
         userNamesList = input("Please enter at least one username OR several usernames with space separated:")
         userNamesList = userNamesList.split()
     else:
         userNamesList = sys.argv[1:]
-    async with aiomultiprocess.Pool() as pool:
-        await asyncio.gather(*[process_user(plurk, user_name) for user_name in userNamesList])
+    state = CrawlState()
+    scheduler = Scheduler()
+    store = MediaStore(state=state)
+    try:
+        async with create_session() as session:
+            plurk = AsyncPlurkAPI(session, CONSUMER_KEY, CONSUMER_SECRET, ACCESS_TOKEN, ACCESS_TOKEN_SECRET)
+            await asyncio.gather(*[process_user(plurk, session, user_name, state, scheduler=scheduler, store=store)
+                                   for user_name in userNamesList])
+    finally:
+        scheduler.close()
+        state.close()
   
 if __name__ == "__main__":
     t1 = time.time()
@@ -0,0 +1,124 @@
+import math
+import time
+import cProfile
+import collections
+
+# --profile: latency histograms per crawl stage, built from the crawler's
+# events (see events.py). Latencies go into logarithmic buckets, four per
+# doubling from 0.1 ms, so memory stays flat however long the crawl runs;
+# percentiles are the upper edge of their bucket (within ~19%).
+BUCKETS_PER_DOUBLING = 4
+MIN_LATENCY = 0.0001
+PROFILERS = ('cprofile', 'yappi')
+
+
+def _bucket(seconds):
+    if seconds <= MIN_LATENCY:
+        return 0
+    return math.ceil(math.log2(seconds / MIN_LATENCY) * BUCKETS_PER_DOUBLING)
+
+
+def _bucket_limit(bucket):
+    return MIN_LATENCY * 2 ** (bucket / BUCKETS_PER_DOUBLING)
+
+
+class Histogram:
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.buckets = collections.Counter()
+
+    def add(self, seconds):
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+        self.buckets[_bucket(seconds)] += 1
+
+    def percentile(self, fraction):
+        rank = fraction * self.count
+        seen = 0
+        for bucket in sorted(self.buckets):
+            seen += self.buckets[bucket]
+            if seen >= rank:
+                return min(_bucket_limit(bucket), self.max)
+        return self.max
+
+
+class StageProfile:
+    # Events listener; stage totals overlap since stages run concurrently
+    def __init__(self):
+        self.stages = {}
+        self.bytes = 0
+        self.started = time.perf_counter()
+
+    def _add(self, stage, seconds):
+        histogram = self.stages.get(stage)
+        if histogram is None:
+            histogram = self.stages[stage] = Histogram()
+        histogram.add(seconds)
+
+    def __call__(self, record):
+        event = record['event']
+        if event == 'api_call':
+            self._add(f"api {record['path']}", record['seconds'])
+            self._add('api rate limit wait', record['wait'])
+        elif event == 'api_retry':
+            self._add('api retry backoff', record['delay'])
+        elif event == 'download':
+            self._add('download', record['seconds'])
+            self.bytes += record['bytes']
+        elif event == 'disk_write':
+            self._add(f"disk write ({record['what']})", record['seconds'])
+        elif event == 'page_fetched':
+            self._add('timeline page fetch', record['seconds'])
+            self._add('queue wait: producer put', record['put_wait'])
+        elif event == 'page_done':
+            self._add('queue wait: consumer get', record['queue_wait'])
+            self._add('page slot wait', record['slot_wait'])
+            self._add('page processing', record['seconds'])
+        elif event == 'post_done' and not record['skipped']:
+            self._add('post', record['seconds'])
+
+    def print_summary(self):
+        elapsed = time.perf_counter() - self.started
+        print("============================\nProfile: latency per stage (ms)")
+        width = max([len('stage')] + [len(stage) for stage in self.stages])
+        print(f"{'stage':<{width}}{'count':>9}{'total s':>10}{'mean':>9}{'p50':>9}{'p90':>9}{'p99':>9}{'max':>9}")
+        for stage, histogram in sorted(self.stages.items()):
+            mean = histogram.total / histogram.count
+            print(f"{stage:<{width}}{histogram.count:>9}{histogram.total:>10.1f}{mean * 1000:>9.1f}"
+                  f"{histogram.percentile(0.5) * 1000:>9.1f}{histogram.percentile(0.9) * 1000:>9.1f}"
+                  f"{histogram.percentile(0.99) * 1000:>9.1f}{histogram.max * 1000:>9.1f}")
+        print(f"Downloaded {self.bytes / 2 ** 20:.1f} MB in {elapsed:.1f}s ({self.bytes / 2 ** 20 / max(elapsed, 1e-9):.2f} MB/s)")
+
+
+class LoopProfiler:
+    # cProfile only sees the event loop thread. yappi (optional,
+    # pip install yappi) covers the worker threads too and uses wall-clock
+    # time, so time spent awaiting shows up under the coroutine that waited.
+    def __init__(self, profiler='cprofile'):
+        self._yappi = None
+        if profiler == 'yappi':
+            try:
+                import yappi
+                self._yappi = yappi
+            except ImportError:
+                print("yappi is not installed (pip install yappi), using cProfile instead")
+        self._profile = None if self._yappi else cProfile.Profile()
+
+    def start(self):
+        if self._yappi:
+            self._yappi.set_clock_type('wall')
+            self._yappi.start()
+        else:
+            self._profile.enable()
+
+    def stop(self, path):
+        if self._yappi:
+            self._yappi.stop()
+            self._yappi.get_func_stats().save(path, type='pstat')
+        else:
+            self._profile.disable()
+            self._profile.dump_stats(path)
+        print(f"Event loop profile written to {path} (view with: python -m pstats {path})")
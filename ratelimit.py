@@ -0,0 +1,83 @@
+import time
+import random
+import asyncio
+
+# Plurk API pacing. The limiter starts at API_RATE calls per second, halves its
+# rate on every throttling response and creeps back up on success, so long
+# crawls settle at the highest rate the API accepts.
+API_RATE = 10.0
+API_BURST = 10
+API_MIN_RATE = 0.2
+API_MAX_RETRIES = 6
+BACKOFF_BASE = 1.0
+BACKOFF_MAX = 120.0
+# Consecutive failures that open the circuit, pausing every caller.
+CIRCUIT_THRESHOLD = 5
+CIRCUIT_COOLDOWN = 60.0
+
+RETRYABLE_STATUS = {408, 429, 500, 502, 503, 504}
+
+
+def backoff_delay(attempt, retry_after=None):
+    # Exponential backoff with full jitter; a server supplied Retry-After wins.
+    if retry_after is not None:
+        return retry_after
+    return random.uniform(0, min(BACKOFF_MAX, BACKOFF_BASE * 2 ** attempt))
+
+
+def parse_retry_after(value):
+    if value is None:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        return None
+
+
+class RateLimiter:
+    def __init__(self, rate=API_RATE, burst=API_BURST, min_rate=API_MIN_RATE,
+                 circuit_threshold=CIRCUIT_THRESHOLD, circuit_cooldown=CIRCUIT_COOLDOWN):
+        self.max_rate = rate
+        self.rate = rate
+        self.burst = burst
+        self.min_rate = min_rate
+        self.circuit_threshold = circuit_threshold
+        self.circuit_cooldown = circuit_cooldown
+        self._tokens = float(burst)
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._failures = 0
+        self._last_throttled = 0.0
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                if now < self._paused_until:
+                    await asyncio.sleep(self._paused_until - now)
+                    continue
+                self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+    def record_success(self):
+        self._failures = 0
+        self.rate = min(self.max_rate, self.rate + self.max_rate * 0.05)
+
+    def record_failure(self, status=None, retry_after=None):
+        now = time.monotonic()
+        self._failures += 1
+        # Concurrent calls rejected in the same burst only halve the rate once.
+        if status == 429 and now - self._last_throttled >= 1.0:
+            self.rate = max(self.min_rate, self.rate / 2)
+            self._last_throttled = now
+        if retry_after is not None:
+            self._paused_until = max(self._paused_until, now + retry_after)
+        if self._failures >= self.circuit_threshold:
+            print(f"Plurk API failed {self._failures} times in a row, pausing all calls for {self.circuit_cooldown:.0f}s")
+            self._paused_until = max(self._paused_until, now + self.circuit_cooldown)
+            self._failures = 0
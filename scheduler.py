@@ -0,0 +1,107 @@
+import asyncio
+import collections
+from urllib.parse import urlsplit
+from ratelimit import RateLimiter, API_RATE
+from workers import Workers
+from events import Events
+from utils import DOWNLOAD_WRITE_BATCH, DOWNLOAD_SEGMENTS
+
+# Default in-flight limits shared by every user crawled in one process.
+API_CONCURRENCY = 4
+DOWNLOADS_PER_HOST = 8
+MAX_OPEN_FILES = 64
+# Timeline pages being processed at once across all users
+PAGE_SLOTS = 8
+# --low-memory caps downloads in flight through the open file limit, and each
+# download writes its chunks as they arrive instead of batching them.
+LOW_MEMORY_OPEN_FILES = 16
+
+
+# Round-robin page slots. A user waiting for a slot queues behind its own
+# earlier requests, and a freed slot goes to the user that has waited longest
+# since it was last served, so one huge timeline can't starve small ones.
+class FairSlots:
+    def __init__(self, slots=PAGE_SLOTS):
+        self._free = slots
+        self._waiting = collections.OrderedDict()
+
+    async def acquire(self, key):
+        if self._free > 0 and not self._waiting:
+            self._free -= 1
+            return
+        future = asyncio.get_running_loop().create_future()
+        self._waiting.setdefault(key, collections.deque()).append(future)
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                self.release()
+            else:
+                waiters = self._waiting.get(key)
+                if waiters is not None and future in waiters:
+                    waiters.remove(future)
+                    if not waiters:
+                        del self._waiting[key]
+            raise
+
+    def release(self):
+        while self._waiting:
+            key, waiters = next(iter(self._waiting.items()))
+            future = waiters.popleft()
+            if waiters:
+                self._waiting.move_to_end(key)
+            else:
+                del self._waiting[key]
+            if not future.done():
+                future.set_result(None)
+                return
+        self._free += 1
+
+
+class Scheduler:
+    def __init__(self, api_concurrency=API_CONCURRENCY, downloads_per_host=DOWNLOADS_PER_HOST,
+                 max_open_files=MAX_OPEN_FILES, api_rate=API_RATE, workers=None, page_slots=PAGE_SLOTS,
+                 events=None, write_batch=DOWNLOAD_WRITE_BATCH, download_segments=DOWNLOAD_SEGMENTS,
+                 url_status=None, memory_limit=None):
+        self.api_concurrency = api_concurrency
+        self.downloads_per_host = downloads_per_host
+        self.max_open_files = max_open_files
+        # Plurk API calls in flight
+        self.api = asyncio.Semaphore(api_concurrency)
+        # Pacing, retry backoff and circuit breaking for those calls
+        self.rate_limiter = RateLimiter(api_rate)
+        # Files held open across an await: each download stream or segment,
+        # off-loop text writes and hashing, and a user's open archive
+        self.files = asyncio.Semaphore(max_open_files)
+        self._hosts = {}
+        # Timeline pages in processing, shared fairly between users
+        self.pages = FairSlots(page_slots)
+        # Thread/process pools for blocking disk and CPU work
+        self.workers = workers or Workers()
+        # Structured progress events (see events.py)
+        self.events = events or Events()
+        # Bytes a download buffers before handing them to the writer
+        self.write_batch = write_batch
+        # Parallel Range requests per large download; see connections_per_host
+        self.download_segments = download_segments
+        # Media URL statuses remembered across runs (see url_status.py)
+        self.url_status = url_status
+        # --low-memory's RSS ceiling (see memory.py)
+        self.memory_limit = memory_limit
+
+    @property
+    def connections_per_host(self):
+        # Connection pool size per host that lets every download in flight
+        # run all its segments at once
+        return max(self.downloads_per_host * max(1, self.download_segments), self.api_concurrency)
+
+    def host(self, url):
+        # Media downloads in flight against one CDN host
+        host = urlsplit(url).netloc.lower()
+        semaphore = self._hosts.get(host)
+        if semaphore is None:
+            semaphore = self._hosts[host] = asyncio.Semaphore(self.downloads_per_host)
+        return semaphore
+
+    def close(self):
+        self.workers.close()
@@ -1,5 +1,7 @@
 import os
 import sys
+import json
+import threading
 import subprocess
 from pathlib import Path
 
@@ -32,8 +34,12 @@ from PySide6.QtWidgets import (
     QGraphicsDropShadowEffect,
     QGraphicsOpacityEffect,
     QComboBox,
+    QSpinBox,
 )
 
+from scheduler import API_CONCURRENCY, DOWNLOADS_PER_HOST, MAX_OPEN_FILES
+from events import EVENTS_TO_STDERR
+
 
 VERSION = "v1.2.0"
 GITHUB_URL = "https://github.com/dundd2"
@@ -56,6 +62,9 @@ TRANSLATIONS = {
         "form_helper": "帳號支援一次輸入多位，使用空格分隔即可。",
         "placeholder_users": "輸入欲備份的使用者帳號，以空白分隔",
         "option_auto_open": "備份完成後自動開啟資料夾",
+        "option_api_concurrency": "API 同時請求數",
+        "option_downloads_per_host": "每主機同時下載數",
+        "option_max_open_files": "最大開啟檔案數",
         "button_reset": "重設欄位",
         "button_start": "開始備份",
         "status_idle": "等待操作…",
@@ -92,6 +101,9 @@ TRANSLATIONS = {
         "form_helper": "You can enter multiple accounts at once, just separate them with spaces.",
         "placeholder_users": "Enter the Plurk usernames to back up, separated by spaces",
         "option_auto_open": "Open the folder automatically when the backup completes",
+        "option_api_concurrency": "API calls in flight",
+        "option_downloads_per_host": "Downloads per host",
+        "option_max_open_files": "Max open files",
         "button_reset": "Reset Form",
         "button_start": "Start Backup",
         "status_idle": "Waiting for your next action…",
@@ -117,32 +129,41 @@ TRANSLATIONS = {
 
 class BackupWorker(QThread):
     output = Signal(str)
+    event = Signal(object)
     finished = Signal(int)
 
-    def __init__(self, usernames, credentials, parent=None):
+    def __init__(self, usernames, credentials, options=None, parent=None):
         super().__init__(parent)
         self.usernames = usernames
         self.credentials = credentials
+        self.options = options or []
 
     def run(self):
-        command = [sys.executable, "main.py", *self.usernames]
+        # Structured events arrive as JSON lines on stderr, the log on stdout
+        command = [sys.executable, "main.py", "--events", EVENTS_TO_STDERR, *self.options, *self.usernames]
         env = os.environ.copy()
         env.update(self.credentials)
+        env["PYTHONIOENCODING"] = "utf-8"
 
         try:
             process = subprocess.Popen(
                 command,
                 stdout=subprocess.PIPE,
-                stderr=subprocess.STDOUT,
+                stderr=subprocess.PIPE,
                 text=True,
+                encoding="utf-8",
+                errors="replace",
                 env=env,
             )
 
+            events_reader = threading.Thread(target=self.read_events, args=(process.stderr,), daemon=True)
+            events_reader.start()
             for line in iter(process.stdout.readline, ""):
                 cleaned = line.rstrip()
                 if cleaned:
                     self.output.emit(cleaned)
             process.stdout.close()
+            events_reader.join()
             return_code = process.wait()
             self.finished.emit(return_code)
         except FileNotFoundError:
@@ -152,12 +173,28 @@ class BackupWorker(QThread):
             self.output.emit(f"Unexpected error: {exc}")
             self.finished.emit(-1)
 
+    def read_events(self, stream):
+        # Anything on stderr that is not an event (e.g. a traceback) goes to the log
+        for line in iter(stream.readline, ""):
+            try:
+                record = json.loads(line)
+            except ValueError:
+                record = None
+            if isinstance(record, dict) and "event" in record:
+                self.event.emit(record)
+            elif line.strip():
+                self.output.emit(line.rstrip())
+        stream.close()
+
 
 class MainWindow(QMainWindow):
     def __init__(self):
         super().__init__()
         self.worker = None
         self.last_usernames = []
+        self.plurks_total = 0
+        self.plurks_done = 0
+        self.plurks_unknown = False
         self.status_animation = None
         self.current_language = "zh-TW"
         self.form_label_widgets = []
@@ -311,6 +348,26 @@ class MainWindow(QMainWindow):
         option_row.addStretch(1)
         card_layout.addLayout(option_row)
 
+        limits_row = QHBoxLayout()
+        limits_row.setSpacing(12)
+        self.limit_label_widgets = []
+        self.api_concurrency_spin = QSpinBox()
+        self.downloads_per_host_spin = QSpinBox()
+        self.max_open_files_spin = QSpinBox()
+        for key, spin, default, maximum in (
+            ("option_api_concurrency", self.api_concurrency_spin, API_CONCURRENCY, 64),
+            ("option_downloads_per_host", self.downloads_per_host_spin, DOWNLOADS_PER_HOST, 64),
+            ("option_max_open_files", self.max_open_files_spin, MAX_OPEN_FILES, 1024),
+        ):
+            label = QLabel(objectName="FormHelper")
+            self.limit_label_widgets.append((label, key))
+            spin.setRange(1, maximum)
+            spin.setValue(default)
+            limits_row.addWidget(label)
+            limits_row.addWidget(spin)
+        limits_row.addStretch(1)
+        card_layout.addLayout(limits_row)
+
         button_row = QHBoxLayout()
         button_row.setSpacing(16)
         button_row.addStretch(1)
@@ -457,6 +514,14 @@ class MainWindow(QMainWindow):
                 color: #0f172a;
                 font-size: 14px;
             }
+            QSpinBox {
+                background-color: rgba(255, 255, 255, 70);
+                border: 1px solid rgba(255, 255, 255, 120);
+                border-radius: 12px;
+                padding: 4px 8px;
+                color: #0f172a;
+                font-size: 13px;
+            }
             QLineEdit:focus {
                 border: 2px solid rgba(137, 196, 244, 220);
                 background-color: rgba(255, 255, 255, 100);
@@ -601,6 +666,8 @@ class MainWindow(QMainWindow):
         self.form_helper.setText(texts["form_helper"])
         self.usernames_edit.setPlaceholderText(texts["placeholder_users"])
         self.open_folder_checkbox.setText(texts["option_auto_open"])
+        for label, key in self.limit_label_widgets:
+            label.setText(texts[key])
         self.clear_button.setText(texts["button_reset"])
         self.start_button.setText(texts["button_start"])
 
@@ -684,11 +751,23 @@ class MainWindow(QMainWindow):
         self.update_status("status_running", "busy")
         self.start_button.setDisabled(True)
         self.clear_button.setDisabled(True)
+        # Indeterminate until the crawler reports how many plurks there are,
+        # and for the whole run once a user's share is unknown (incremental,
+        # resumed or filtered backups)
+        self.plurks_total = 0
+        self.plurks_done = 0
+        self.plurks_unknown = False
         self.progress_bar.setRange(0, 0)
         self.progress_bar.setVisible(True)
 
-        self.worker = BackupWorker(usernames, credentials, self)
+        options = [
+            "--api-concurrency", str(self.api_concurrency_spin.value()),
+            "--downloads-per-host", str(self.downloads_per_host_spin.value()),
+            "--max-open-files", str(self.max_open_files_spin.value()),
+        ]
+        self.worker = BackupWorker(usernames, credentials, options, self)
         self.worker.output.connect(self.append_log)
+        self.worker.event.connect(self.handle_event)
         self.worker.finished.connect(self.backup_finished)
         self.worker.start()
 
@@ -701,6 +780,25 @@ class MainWindow(QMainWindow):
         ):
             self.update_status("status_warning_detected", "warning")
 
+    def handle_event(self, event):
+        kind = event.get("event")
+        if kind == "user_started":
+            if event.get("expected_plurks") is None:
+                self.plurks_unknown = True
+            else:
+                self.plurks_total += event["expected_plurks"]
+        elif kind == "post_done":
+            self.plurks_done += 1
+            if not event.get("ok") and self.current_status_key != "status_warning_detected":
+                self.update_status("status_warning_detected", "warning")
+        else:
+            return
+        if self.plurks_unknown:
+            self.progress_bar.setRange(0, 0)
+        elif self.plurks_total:
+            self.progress_bar.setRange(0, self.plurks_total)
+            self.progress_bar.setValue(min(self.plurks_done, self.plurks_total))
+
     def backup_finished(self, return_code):
         if return_code == 0:
             self.update_status("status_success", "success")
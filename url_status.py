@@ -0,0 +1,74 @@
+import time
+
+# What the last request for each media URL returned, kept in the crawl state
+# database so a re-run doesn't go back to the network for what it already
+# learned:
+#   404/410      dead link, skipped until DEAD_URL_TTL has passed
+#   UNREACHABLE  host did not resolve or refused the connection, skipped
+#                until UNREACHABLE_TTL has passed
+#   200          downloaded; a media store copy is trusted for OK_URL_TTL and
+#                then revalidated with a conditional GET (ETag/Last-Modified)
+# Other answers (403, 5xx, timeouts) may be temporary and are not recorded.
+UNREACHABLE = 0
+DEAD_STATUSES = (404, 410)
+DEAD_URL_TTL = 7 * 24 * 3600
+UNREACHABLE_TTL = 24 * 3600
+OK_URL_TTL = 30 * 24 * 3600
+
+
+class UrlStatus:
+    def __init__(self, state, recheck=False):
+        self.state = state
+        # --recheck-urls: ignore what earlier runs recorded, but keep recording
+        self.recheck = recheck
+
+    def dead(self, url):
+        # The recorded status while a dead or unreachable URL is still cached
+        if self.recheck:
+            return None
+        found = self.state.url_status(url)
+        if found is None:
+            return None
+        status, checked_at = found[0], found[4]
+        if status in DEAD_STATUSES:
+            ttl = DEAD_URL_TTL
+        elif status == UNREACHABLE:
+            ttl = UNREACHABLE_TTL
+        else:
+            return None
+        return status if time.time() - checked_at < ttl else None
+
+    def gone(self, url):
+        # Whether the last request for the URL found it dead, however long ago
+        found = self.state.url_status(url)
+        return found is not None and found[0] in DEAD_STATUSES
+
+    def validators(self, url):
+        # (etag, last_modified) of a downloaded URL due for revalidation, or
+        # None while it is fresh or when there is nothing to revalidate with
+        found = self.state.url_status(url)
+        if found is None:
+            return None
+        status, etag, last_modified, _, checked_at = found
+        if status != 200 or not (etag or last_modified):
+            return None
+        if not self.recheck and time.time() - checked_at < OK_URL_TTL:
+            return None
+        return etag, last_modified
+
+    def record(self, url, status, etag=None, last_modified=None, size=None):
+        if status == 200 or status == UNREACHABLE or status in DEAD_STATUSES:
+            self.state.record_url_status(url, status, etag, last_modified, size)
+
+    def record_response(self, url, response, size=None):
+        etag, last_modified = response.headers.get('ETag'), response.headers.get('Last-Modified')
+        status = response.status
+        if status == 304:
+            # A 304 may leave out the validators; keep the recorded ones
+            _, old_etag, old_last_modified, size, _ = self.state.url_status(url)
+            etag, last_modified = etag or old_etag, last_modified or old_last_modified
+        self.record(url, 200 if status in (206, 304) else status, etag, last_modified, size)
+
+
+def describe(status):
+    return 'host unreachable' if status == UNREACHABLE else f'HTTP {status}'
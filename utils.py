@@ -1,4 +1,53 @@
+import os
+import time
 import re
+import html
+import asyncio
+import hashlib
+import calendar
+import contextlib
+import functools
+import collections
+import email.utils
+import aiohttp
+from workers import Workers
+from url_status import UNREACHABLE, describe
+
+# Shared HTTP client defaults: one pooled connector is reused for the whole
+# crawl so posts hitting the same CDN host share keep-alive connections.
+HTTP_CONNECTION_LIMIT = 100
+HTTP_LIMIT_PER_HOST = 8
+HTTP_KEEPALIVE_TIMEOUT = 60
+HTTP_DNS_CACHE_TTL = 600
+HTTP_CONNECT_TIMEOUT = 30
+HTTP_READ_TIMEOUT = 60
+
+# Media is streamed to "<name>.part" in fixed-size chunks and only renamed to
+# its final name once complete, so a crash never leaves a truncated file that
+# looks already downloaded. Leftover .part files are resumed with HTTP Range.
+DOWNLOAD_CHUNK_SIZE = 64 * 1024
+# Chunks are handed to the writer in batches of up to this many bytes, which
+# bounds per-download memory while keeping executor round trips rare.
+DOWNLOAD_WRITE_BATCH = 1024 * 1024
+PARTIAL_SUFFIX = '.part'
+# Large files (mostly videos) are fetched in DOWNLOAD_SEGMENTS parallel Range
+# requests when the server advertises byte ranges: the first response is only
+# a probe and is closed, then every segment is requested on its own
+# connection and written at its own offset of a preallocated .part file.
+# Nothing holds a connection while waiting for another, so downloads can't
+# starve each other out of the pool. Smaller files, servers without range
+# support and resumed downloads use a single stream.
+SEGMENTED_DOWNLOAD_MIN_SIZE = 16 * 1024 * 1024
+DOWNLOAD_SEGMENTS = 4
+
+# A GET is only saved when the server answers with a media type; anything
+# else (typically an HTML error page served with 200) is skipped.
+MEDIA_CONTENT_TYPES = ('image/', 'video/', 'application/octet-stream', 'binary/octet-stream')
+
+# Used when no scheduler is given: blocking file work runs inline and the
+# number of open files is not limited.
+INLINE_WORKERS = Workers('asyncio')
+NO_FILE_LIMIT = contextlib.nullcontext()
 
 url_validation_pattern = re.compile(
     r'^(?:http|ftp)s?://'
@@ -8,15 +57,321 @@ url_validation_pattern = re.compile(
     r'(?::\d+)?' 
     r'(?:/?|[/?]\S+)$', re.IGNORECASE)
 
-async def url_exists(session, path):
+# Media links in post/response HTML, found in one pass of a compiled pattern:
+# the href of each <a> (an <img> right inside it is only the link's preview
+# thumbnail) and the src of standalone <img> tags. The extension is taken from
+# the URL path, so query strings and fragments don't hide it.
+MEDIA_EXTENSIONS = frozenset(('jpg', 'jpeg', 'png', 'gif', 'mp4', 'webm', 'webp', 'bmp', 'svg'))
+# Standalone images from these hosts are emoticons, not attachments
+IGNORED_IMAGE_HOSTS = frozenset(('s.plurk.com', 'emos.plurk.com', 'statics.plurk.com'))
+_LINK_URL = r"""((?:https?|ftp)://[^"'\s<>]+)"""
+media_link_pattern = re.compile(r"""<(?:a\s[^>]*?href=(["'])""" + _LINK_URL + r"""\1[^>]*>(?:<img\s[^>]*>)?"""
+                                r"""|img\s[^>]*?src=(["'])""" + _LINK_URL + r"""\3)""",
+                                re.IGNORECASE)
+
+def media_extension(url):
+    path = url.split('?', 1)[0].split('#', 1)[0]
+    name = path.rpartition('/')[2]
+    ext = name.rpartition('.')[2].lower() if '.' in name else ''
+    return ext if ext in MEDIA_EXTENSIONS else None
+
+def extract_media_links(content):
+    # [(url, ext)] in document order, each URL once
+    links = []
+    seen = set()
+    for _, href, _, src in media_link_pattern.findall(content):
+        url = href or src
+        if '&' in url:
+            url = html.unescape(url)
+        if url in seen:
+            continue
+        seen.add(url)
+        ext = media_extension(url)
+        if ext is None or url_validation_pattern.match(url) is None:
+            continue
+        if src and url.split('/', 3)[2].lower() in IGNORED_IMAGE_HOSTS:
+            continue
+        links.append((url, ext))
+    return links
+
+# 'posted' is an RFC 822 date in GMT, e.g. 'Fri, 05 Jun 2009 23:07:13 GMT'.
+# Each post's date is needed by the producer (offsets, checkpoint), for file
+# names and for the crawl state, so it is split once with a precomputed month
+# table and the result cached.
+MONTH_NUMBERS = {name: num for num, name in enumerate(calendar.month_abbr) if num}
+POSTED_CACHE_SIZE = 4096
+# epoch: seconds since 1970 UTC; file_date: '2009_6_05' as used in file
+# names; offset: '2009-6-05T23:07:13' as passed to getPublicPlurks
+PostedTime = collections.namedtuple('PostedTime', 'epoch file_date offset')
+
+@functools.lru_cache(maxsize=POSTED_CACHE_SIZE)
+def parse_posted(posted):
+    try:
+        _, day, month, year, clock, zone = posted.split()
+        if zone != 'GMT':
+            raise ValueError(zone)
+        month = MONTH_NUMBERS[month]
+        hour, minute, second = clock.split(':')
+        epoch = calendar.timegm((int(year), month, int(day), int(hour), int(minute), int(second)))
+    except (ValueError, KeyError):
+        epoch = email.utils.mktime_tz(email.utils.parsedate_tz(posted))
+        utc = time.gmtime(epoch)
+        year, month, day = utc.tm_year, utc.tm_mon, f"{utc.tm_mday:02d}"
+        clock = f"{utc.tm_hour:02d}:{utc.tm_min:02d}:{utc.tm_sec:02d}"
+    return PostedTime(epoch, f"{year}_{month}_{day}", f"{year}-{month}-{day}T{clock}")
+
+def posted_to_epoch(posted):
+    return parse_posted(posted).epoch
+
+def create_session(limit=HTTP_CONNECTION_LIMIT, limit_per_host=HTTP_LIMIT_PER_HOST,
+                   keepalive_timeout=HTTP_KEEPALIVE_TIMEOUT, dns_cache_ttl=HTTP_DNS_CACHE_TTL):
+    connector = aiohttp.TCPConnector(limit=limit,
+                                     limit_per_host=limit_per_host,
+                                     keepalive_timeout=keepalive_timeout,
+                                     use_dns_cache=True,
+                                     ttl_dns_cache=dns_cache_ttl)
+    timeout = aiohttp.ClientTimeout(total=None, sock_connect=HTTP_CONNECT_TIMEOUT, sock_read=HTTP_READ_TIMEOUT)
+    return aiohttp.ClientSession(connector=connector, timeout=timeout,
+                                 headers={'Connection': 'keep-alive'})
+
+def write_text(path, text):
+    with open(path, "w", encoding="utf-8") as text_file:
+        text_file.write(text)
+
+def write_texts(items):
+    for path, text in items:
+        write_text(path, text)
+
+def hash_file(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as handler:
+        for block in iter(lambda: handler.read(DOWNLOAD_WRITE_BATCH), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+def _open_part(part_name, offset):
+    # Returns the part file handle and a sha256 seeded with any resumed bytes
+    digest = hashlib.sha256()
+    if offset:
+        with open(part_name, 'rb') as handler:
+            for block in iter(lambda: handler.read(DOWNLOAD_WRITE_BATCH), b''):
+                digest.update(block)
+    return open(part_name, 'ab' if offset else 'wb'), digest
+
+def _write_batch(handler, digest, chunks):
+    for chunk in chunks:
+        digest.update(chunk)
+    handler.writelines(chunks)
+
+def _close_part(handler):
+    handler.flush()
+    os.fsync(handler.fileno())
+    handler.close()
+
+def _preallocate(part_name, size):
+    with open(part_name, 'wb') as handler:
+        handler.truncate(size)
+
+def _open_segment(part_name, start):
+    # One handle per segment, so seek + write stays positional without
+    # os.pwrite (which Windows lacks)
+    handler = open(part_name, 'r+b')
+    handler.seek(start)
+    return handler
+
+def _write_chunks(handler, chunks):
+    handler.writelines(chunks)
+
+def _sync_file(path):
+    with open(path, 'r+b') as handler:
+        os.fsync(handler.fileno())
+
+class RangeNotSupported(Exception):
+    pass
+
+# Returns the sha256 hex digest of the saved file, or False on failure. With
+# validators (etag, last_modified) of a stored copy the request is a
+# conditional GET: NOT_MODIFIED when the server answers 304, and a changed
+# file is saved from that same response.
+NOT_MODIFIED = 'not modified'
+
+async def download_image(session, image_url, image_name, scheduler=None, validators=None):
+    if scheduler is None:
+        return await _stream_download(session, image_url, image_name, INLINE_WORKERS, DOWNLOAD_WRITE_BATCH)
+    url_status = scheduler.url_status
+    dead = url_status.dead(image_url) if url_status is not None else None
+    if dead is not None:
+        print(f"Skipped {image_url}: {describe(dead)} on an earlier run")
+        return False
+    started = time.perf_counter()
+    # A revalidation keeps its one response, so it is never segmented
+    segments = 1 if validators is not None else scheduler.download_segments
+    async with scheduler.host(image_url):
+        sha256 = await _stream_download(session, image_url, image_name, scheduler.workers, scheduler.write_batch,
+                                        segments, url_status, scheduler.files, validators)
+    if scheduler.events.enabled:
+        scheduler.events.emit('download', url=image_url, ok=bool(sha256),
+                              bytes=os.path.getsize(image_name) if sha256 and sha256 != NOT_MODIFIED else 0,
+                              seconds=time.perf_counter() - started)
+    return sha256
+
+# open_files (the scheduler's open file slots) is taken before each request
+# whose body is written to a file and held until the file is closed; a
+# segmented download gives up the probe's slot and takes one per segment.
+# Nothing waits for a slot while holding a connection or another slot.
+async def _stream_download(session, image_url, image_name, workers, write_batch, segments=DOWNLOAD_SEGMENTS,
+                           url_status=None, open_files=NO_FILE_LIMIT, validators=None):
+    part_name = image_name + PARTIAL_SUFFIX
     try:
-        async with session.head(path, allow_redirects=True, timeout=10) as response:
-            return response.status == 200
-    except Exception as e:
-        print(f"Error checking URL: {e}")
+        while True:
+            # A leftover part file can't be resumed against a changed file
+            offset = os.path.getsize(part_name) if validators is None and os.path.isfile(part_name) else 0
+            headers = {'Range': f'bytes={offset}-'} if offset else {}
+            if validators is not None:
+                etag, last_modified = validators
+                if etag:
+                    headers['If-None-Match'] = etag
+                if last_modified:
+                    headers['If-Modified-Since'] = last_modified
+            probe = None
+            async with open_files, session.get(image_url, headers=headers) as response:
+                if response.status == 416:
+                    # The partial file is stale or already complete; start over.
+                    await workers.io(os.remove, part_name)
+                    continue
+                if response.status == 304 and validators is not None:
+                    if url_status is not None:
+                        url_status.record_response(image_url, response)
+                    return NOT_MODIFIED
+                if response.status not in (200, 206):
+                    print(f"Error downloading {image_url}: HTTP {response.status}")
+                    if url_status is not None:
+                        url_status.record_response(image_url, response)
+                    return False
+                if not response.content_type.startswith(MEDIA_CONTENT_TYPES):
+                    print(f"Not a media file {image_url}: {response.content_type}")
+                    return False
+                if response.status == 200:
+                    offset = 0
+                elif offset and not response.headers.get('Content-Range', '').startswith(f'bytes {offset}-'):
+                    # Not the bytes that follow the partial file; appending them
+                    # would corrupt it, so start over.
+                    response.close()
+                    print(f"Unexpected range from {image_url}, restarting the download")
+                    await workers.io(os.remove, part_name)
+                    continue
+                expected = None if 'Content-Encoding' in response.headers else response.content_length
+                if (segments > 1 and response.status == 200 and expected is not None
+                        and expected >= SEGMENTED_DOWNLOAD_MIN_SIZE
+                        and response.headers.get('Accept-Ranges', '').lower() == 'bytes'):
+                    response.close()
+                    probe = response
+                else:
+                    written = 0
+                    handler, digest = await workers.io(_open_part, part_name, offset)
+                    try:
+                        pending = []
+                        pending_size = 0
+                        async for chunk in response.content.iter_chunked(DOWNLOAD_CHUNK_SIZE):
+                            pending.append(chunk)
+                            pending_size += len(chunk)
+                            if pending_size >= write_batch:
+                                await workers.io(_write_batch, handler, digest, pending)
+                                written += pending_size
+                                pending = []
+                                pending_size = 0
+                        if pending:
+                            await workers.io(_write_batch, handler, digest, pending)
+                            written += pending_size
+                    finally:
+                        await workers.io(_close_part, handler)
+                    if expected is not None and written != expected:
+                        print(f"Incomplete download {image_url}: {written} of {expected} bytes, will resume next run")
+                        return False
+                    if url_status is not None:
+                        url_status.record_response(image_url, response, offset + written)
+            if probe is None:
+                await workers.io(os.replace, part_name, image_name)
+                return digest.hexdigest()
+            try:
+                sha256 = await _segmented_download(session, image_url, image_name, expected,
+                                                   workers, write_batch, segments, open_files)
+            except RangeNotSupported:
+                print(f"{image_url} does not serve byte ranges, downloading it as one stream")
+                segments = 1
+                continue
+            if sha256 and url_status is not None:
+                url_status.record_response(image_url, probe, expected)
+            return sha256
+    except aiohttp.ClientConnectorError as e:
+        print(f"Error downloading {image_url}: {e}")
+        if url_status is not None:
+            url_status.record(image_url, UNREACHABLE)
         return False
-    
-async def download_image(session, image_url, image_name):
-    async with session.get(image_url) as response:
-        with open(image_name, 'wb') as handler:
-            handler.write(await response.read())  
\ No newline at end of file
+    except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+        print(f"Error downloading {image_url}: {e}")
+        return False
+
+async def _segmented_download(session, image_url, image_name, size, workers, write_batch, segments,
+                              open_files=NO_FILE_LIMIT):
+    part_name = image_name + PARTIAL_SUFFIX
+    segment_size = -(-size // segments)
+    bounds = [(start, min(start + segment_size, size) - 1) for start in range(0, size, segment_size)]
+    async with open_files:
+        await workers.io(_preallocate, part_name, size)
+    tasks = [asyncio.ensure_future(_fetch_segment(session, image_url, part_name, start, end, workers, write_batch,
+                                                  open_files))
+             for start, end in bounds]
+    try:
+        try:
+            written = sum(await asyncio.gather(*tasks))
+        except BaseException:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            raise
+        if written != size:
+            print(f"Incomplete download {image_url}: {written} of {size} bytes")
+            await workers.io(os.remove, part_name)
+            return False
+    except BaseException:
+        # A preallocated part file has holes, so it can't be resumed
+        if os.path.isfile(part_name):
+            await workers.io(os.remove, part_name)
+        raise
+    async with open_files:
+        await workers.io(_sync_file, part_name)
+        sha256 = await workers.cpu(hash_file, part_name)
+    await workers.io(os.replace, part_name, image_name)
+    return sha256
+
+async def _fetch_segment(session, image_url, part_name, start, end, workers, write_batch, open_files=NO_FILE_LIMIT):
+    # Writes bytes start..end of the file and returns how many were written
+    async with open_files, session.get(image_url, headers={'Range': f'bytes={start}-{end}'}) as response:
+        if response.status != 206 or not response.headers.get('Content-Range', '').startswith(f'bytes {start}-{end}/'):
+            raise RangeNotSupported(image_url)
+        return await _write_segment(response, part_name, start, end - start + 1, workers, write_batch)
+
+async def _write_segment(response, part_name, start, length, workers, write_batch):
+    written = 0
+    handler = await workers.io(_open_segment, part_name, start)
+    try:
+        pending = []
+        pending_size = 0
+        async for chunk in response.content.iter_chunked(DOWNLOAD_CHUNK_SIZE):
+            chunk = chunk[:length - written - pending_size]
+            pending.append(chunk)
+            pending_size += len(chunk)
+            if pending_size >= write_batch or written + pending_size == length:
+                await workers.io(_write_chunks, handler, pending)
+                written += pending_size
+                pending = []
+                pending_size = 0
+                if written == length:
+                    break
+        if pending:
+            await workers.io(_write_chunks, handler, pending)
+            written += pending_size
+    finally:
+        await workers.io(handler.close)
+    return written
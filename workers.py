@@ -0,0 +1,39 @@
+import os
+import asyncio
+from functools import partial
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+
+# Where the crawler runs its blocking work. Network I/O always stays on the
+# event loop; these modes only decide who performs disk writes/fsync ("io")
+# and CPU-bound stages such as hashing ("cpu"):
+#   asyncio - both run inline on the event loop thread
+#   thread  - both run in a thread pool
+#   process - io in a thread pool, cpu in a process pool
+WORKER_MODES = ('asyncio', 'thread', 'process')
+DEFAULT_WORKER_MODE = 'thread'
+WORKER_THREADS = min(32, (os.cpu_count() or 1) + 4)
+
+
+class Workers:
+    def __init__(self, mode=DEFAULT_WORKER_MODE, max_workers=WORKER_THREADS):
+        if mode not in WORKER_MODES:
+            raise ValueError(f"Unknown worker mode {mode!r}, expected one of {', '.join(WORKER_MODES)}")
+        self.mode = mode
+        self._threads = ThreadPoolExecutor(max_workers) if mode != 'asyncio' else None
+        self._processes = ProcessPoolExecutor() if mode == 'process' else None
+
+    async def io(self, fn, *args):
+        if self._threads is None:
+            return fn(*args)
+        return await asyncio.get_running_loop().run_in_executor(self._threads, partial(fn, *args))
+
+    async def cpu(self, fn, *args):
+        executor = self._processes or self._threads
+        if executor is None:
+            return fn(*args)
+        return await asyncio.get_running_loop().run_in_executor(executor, partial(fn, *args))
+
+    def close(self):
+        for executor in (self._threads, self._processes):
+            if executor is not None:
+                executor.shutdown()